@@ -0,0 +1,275 @@
+"""Synthetic order-flow benchmark for the matching and settlement hot path.
+
+Generates a reproducible stream of orders (Poisson arrivals, rates spread
+around the seeded market prices, a share of orders cancelled after an
+exponential lifetime) and replays it against a fresh database the way the
+API does: each new order is committed as PENDING and submitted to a
+MatchingEngine, and cancels are queued to the same engine. Up to
+--in-flight commands are outstanding at once, so 1 measures per-order
+latency through the engine and larger values let it batch.
+
+    python -m benchmarks.order_flow --orders 5000 --save-baseline baseline.json
+    python -m benchmarks.order_flow --orders 5000 --baseline baseline.json
+
+Events are replayed back to back, so throughput is the engine's capacity
+rather than the simulated arrival rate. Match latency runs from submission
+to the engine committing the order's batch. A baseline is only compared
+with a run of the same workload parameters.
+"""
+from sqlalchemy import create_engine, event
+from database import Base, SessionLocal
+from models import User, Token, Order, MarketPrice, TokenType, TradeStatus
+from services.matching_engine import MatchingEngine
+from init_db import MARKET_PRICES
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from itertools import permutations
+from typing import Deque, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# Arguments that define the workload; runs are only comparable if these match
+WORKLOAD_ARGS = (
+    "orders", "users", "arrival_rate", "cancel_ratio", "mean_lifetime", "rate_sigma",
+    "mean_amount", "balance", "seed", "in_flight"
+)
+
+def generate_flow(
+    orders: int,
+    users: int,
+    arrival_rate: float,
+    cancel_ratio: float,
+    mean_lifetime: float,
+    rate_sigma: float,
+    mean_amount: float,
+    seed: int
+) -> List[Tuple[float, str, dict]]:
+    """Build a time-ordered list of (time, "new" | "cancel", params) events"""
+    rng = random.Random(seed)
+    pairs = list(permutations(TokenType, 2))
+    events = []
+    now = 0.0
+
+    for index in range(orders):
+        now += rng.expovariate(arrival_rate)
+        from_token, to_token = rng.choice(pairs)
+        market_rate = MARKET_PRICES[from_token][0] / MARKET_PRICES[to_token][0]
+        events.append((now, "new", {
+            "index": index,
+            "user": rng.randrange(users),
+            "from_token": from_token,
+            "to_token": to_token,
+            "amount": rng.expovariate(1.0 / mean_amount),
+            "exchange_rate": market_rate * math.exp(rng.gauss(0.0, rate_sigma))
+        }))
+        if rng.random() < cancel_ratio:
+            events.append((now + rng.expovariate(1.0 / mean_lifetime), "cancel", {"index": index}))
+
+    events.sort(key=lambda e: e[0])
+    return events
+
+def setup_database(url: str, users: int, balance: float):
+    bench_engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    Base.metadata.create_all(bind=bench_engine)
+    SessionLocal.configure(bind=bench_engine)
+
+    db = SessionLocal()
+    try:
+        for token_type, (price_btc, price_usd) in MARKET_PRICES.items():
+            db.add(MarketPrice(token_type=token_type, price_btc=price_btc, price_usd=price_usd))
+
+        user_rows = [
+            User(username=f"bench{i}", email=f"bench{i}@example.com", password_hash="x")
+            for i in range(users)
+        ]
+        db.add_all(user_rows)
+        db.flush()
+
+        db.add_all([
+            Token(user_id=user.id, token_type=token_type, balance=balance)
+            for user in user_rows for token_type in TokenType
+        ])
+        db.commit()
+        return bench_engine, [user.id for user in user_rows]
+    finally:
+        db.close()
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def run(args) -> Dict[str, float]:
+    # A file rather than an in-memory database, since the engine writes from its own thread
+    handle, path = tempfile.mkstemp(suffix=".db", prefix="order_flow_")
+    os.close(handle)
+    bench_engine, user_ids = setup_database(f"sqlite:///{path}", args.users, args.balance)
+
+    statements = [0]
+
+    @event.listens_for(bench_engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements[0] += 1
+
+    events = generate_flow(
+        args.orders, args.users, args.arrival_rate, args.cancel_ratio,
+        args.mean_lifetime, args.rate_sigma, args.mean_amount, args.seed
+    )
+
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, name="order-flow-loop", daemon=True)
+    loop_thread.start()
+    engine = MatchingEngine()
+    asyncio.run_coroutine_threadsafe(engine.start(), loop).result()
+
+    order_ids: Dict[int, int] = {}
+    in_flight: Deque[Future] = deque()
+    match_latencies = []
+    counts = {"trades": 0, "cancels": 0}
+
+    def settle(kind: str, submitted: float, future: Future):
+        # Runs on the engine's loop once the command's batch is committed
+        error: Optional[BaseException] = future.exception()
+        if kind == "new":
+            match_latencies.append(time.perf_counter() - submitted)
+            if error is None:
+                counts["trades"] += len(future.result())
+        elif error is None:
+            counts["cancels"] += 1
+
+    def track(kind: str, future: Future):
+        future.add_done_callback(partial(settle, kind, time.perf_counter()))
+        in_flight.append(future)
+
+    try:
+        started = time.perf_counter()
+        for _, kind, params in events:
+            while len(in_flight) >= args.in_flight:
+                in_flight.popleft().exception()
+
+            if kind == "new":
+                db = SessionLocal()
+                try:
+                    order = Order(
+                        user_id=user_ids[params["user"]],
+                        from_token=params["from_token"],
+                        to_token=params["to_token"],
+                        amount=params["amount"],
+                        exchange_rate=params["exchange_rate"]
+                    )
+                    db.add(order)
+                    db.commit()
+                    order_ids[params["index"]] = order.id
+                    track("new", engine.submit(order))
+                finally:
+                    db.close()
+            else:
+                db = SessionLocal()
+                try:
+                    order = db.get(Order, order_ids[params["index"]])
+                    if order is not None and order.status == TradeStatus.PENDING:
+                        track("cancel", engine.cancel(order))
+                finally:
+                    db.close()
+
+        while in_flight:
+            in_flight.popleft().exception()
+        elapsed = time.perf_counter() - started
+    finally:
+        asyncio.run_coroutine_threadsafe(engine.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+
+    bench_engine.dispose()
+    os.remove(path)
+
+    return {
+        "orders": args.orders,
+        "events": len(events),
+        "trades": counts["trades"],
+        "cancels": counts["cancels"],
+        "seconds": elapsed,
+        "orders_per_sec": args.orders / elapsed,
+        "p50_match_ms": percentile(match_latencies, 0.50) * 1000,
+        "p99_match_ms": percentile(match_latencies, 0.99) * 1000,
+        "statements_per_order": statements[0] / args.orders,
+    }
+
+# metric -> True if higher is better
+COMPARED_METRICS = {
+    "orders_per_sec": True,
+    "p50_match_ms": False,
+    "p99_match_ms": False,
+    "statements_per_order": False,
+}
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], max_regression: float) -> List[str]:
+    regressions = []
+    print(f"\n{'metric':<24}{'baseline':>14}{'current':>14}{'change':>10}")
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        before, after = baseline[metric], results[metric]
+        change = (after - before) / before if before else 0.0
+        print(f"{metric:<24}{before:>14.3f}{after:>14.3f}{change:>+10.1%}")
+        worse = -change if higher_is_better else change
+        if worse > max_regression:
+            regressions.append(metric)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--arrival-rate", type=float, default=100.0, help="Mean new orders per simulated second")
+    parser.add_argument("--cancel-ratio", type=float, default=0.3, help="Share of orders that are later cancelled")
+    parser.add_argument("--mean-lifetime", type=float, default=5.0, help="Mean simulated seconds before a cancel")
+    parser.add_argument("--rate-sigma", type=float, default=0.03, help="Log-normal spread of rates around market")
+    parser.add_argument("--mean-amount", type=float, default=100.0)
+    parser.add_argument("--balance", type=float, default=1e12)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--in-flight", type=int, default=1, help="Engine commands outstanding at once")
+    parser.add_argument("--baseline", help="Compare against results saved with --save-baseline")
+    parser.add_argument("--save-baseline", help="Write results as JSON to this path")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        recorded = baseline.get("args", {})
+        different = [name for name in WORKLOAD_ARGS if recorded.get(name) != getattr(args, name)]
+        if different:
+            parser.error(
+                f"Baseline {args.baseline} was recorded with a different workload: " + ", ".join(
+                    f"--{name.replace('_', '-')} {recorded.get(name)} (now {getattr(args, name)})" for name in different
+                )
+            )
+
+    results = run(args)
+    for metric, value in results.items():
+        print(f"{metric:<24}{value:>14.3f}" if isinstance(value, float) else f"{metric:<24}{value:>14}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline["results"], args.max_regression)
+        if regressions:
+            print(f"\nRegressed beyond {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
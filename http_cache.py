@@ -0,0 +1,59 @@
+from fastapi import Request, Response, status
+from typing import Callable, Hashable, Optional
+import hashlib
+import threading
+
+def strong_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match lists etag (weak comparison, as RFC 9110 specifies for If-None-Match)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def cached_json(body: bytes, etag: str, cache_control: str, request: Request) -> Response:
+    """200 with body, or 304 if the client already has etag"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+class VersionedResponse:
+    """One serialized JSON body, cached until its version key changes.
+
+    The key is built from in-process version counters, so a request whose
+    key matches the cached one is answered (200 or 304) without running the
+    query or serializing again. The ETag is a hash of the body, so it stays
+    valid across restarts and across version bumps that change nothing.
+    """
+
+    def __init__(self, cache_control: str = "no-cache"):
+        self.cache_control = cache_control
+        self._lock = threading.Lock()
+        self._key: Optional[Hashable] = None
+        self._body = b""
+        self._etag = ""
+
+    def respond(self, request: Request, key: Hashable, build: Callable[[], bytes]) -> Response:
+        with self._lock:
+            cached = self._key == key
+            body, etag = self._body, self._etag
+
+        if not cached:
+            body = build()
+            etag = strong_etag(body)
+            with self._lock:
+                self._key, self._body, self._etag = key, body, etag
+
+        return cached_json(body, etag, self.cache_control, request)
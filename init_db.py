@@ -1,13 +1,39 @@
+from sqlalchemy import func, insert, inspect, text
 from sqlalchemy.orm import Session
 from database import engine, SessionLocal, Base
-from models import User, Token, MarketPrice, TokenType, ConversionRate, TransactionType, SellerApiKey
+from models import (
+    User, Token, Trade, Order, MarketPrice, TokenType, TradeStatus, ConversionRate, TransactionType,
+    TransactionHistory, SellerApiKey
+)
 from auth import get_password_hash
 from services import ConversionService
+from services.ledger_audit import grouped_cumsum
+from datetime import datetime, timedelta
+import numpy as np
 import random
+import time
+
+MARKET_PRICES = {
+    TokenType.OPENAI: (0.000001, 0.05),
+    TokenType.ANTHROPIC: (0.0000012, 0.06),
+    TokenType.GOOGLE: (0.0000008, 0.04),
+    TokenType.COHERE: (0.0000009, 0.045),
+    TokenType.MISTRAL: (0.0000007, 0.035),
+}
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
 
+    # create_all skips tables that already exist, so add columns and indexes introduced since
+    order_columns = {column["name"] for column in inspect(engine).get_columns("orders")}
+    if "filled_amount" not in order_columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE orders ADD COLUMN filled_amount FLOAT NOT NULL DEFAULT 0"))
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
 def seed_data():
     db = SessionLocal()
     
@@ -33,13 +59,19 @@ def seed_data():
                 balance=initial_balance
             )
             db.add(token)
-        
+            db.add(TransactionHistory(
+                user_id=demo_user.id,
+                token_type=token_type,
+                transaction_type=TransactionType.INITIAL_BALANCE,
+                amount=initial_balance,
+                balance_before=0.0,
+                balance_after=initial_balance,
+                description="Initial balance"
+            ))
+
         market_prices = [
-            MarketPrice(token_type=TokenType.OPENAI, price_btc=0.000001, price_usd=0.05),
-            MarketPrice(token_type=TokenType.ANTHROPIC, price_btc=0.0000012, price_usd=0.06),
-            MarketPrice(token_type=TokenType.GOOGLE, price_btc=0.0000008, price_usd=0.04),
-            MarketPrice(token_type=TokenType.COHERE, price_btc=0.0000009, price_usd=0.045),
-            MarketPrice(token_type=TokenType.MISTRAL, price_btc=0.0000007, price_usd=0.035),
+            MarketPrice(token_type=token_type, price_btc=price_btc, price_usd=price_usd)
+            for token_type, (price_btc, price_usd) in MARKET_PRICES.items()
         ]
         
         for price in market_prices:
@@ -47,19 +79,212 @@ def seed_data():
         
         db.commit()
         
-        for from_token in TokenType:
-            for to_token in TokenType:
+        rates = ConversionService.get_rate_matrix(db)
+        tokens = list(TokenType)
+        for i, from_token in enumerate(tokens):
+            for j, to_token in enumerate(tokens):
                 if from_token != to_token:
-                    try:
-                        ConversionService.get_or_create_conversion_rate(from_token, to_token, db)
-                    except Exception as e:
-                        print(f"Error creating conversion rate {from_token.value} -> {to_token.value}: {e}")
+                    db.add(ConversionRate(
+                        from_token=from_token,
+                        to_token=to_token,
+                        market_rate=float(rates[i, j]),
+                        volume_24h=0.0
+                    ))
+        db.commit()
         
         print("Database seeded successfully")
         
     finally:
         db.close()
 
+def _insert_batches(table, columns: dict, batch_size: int, label: str):
+    """Bulk insert equal-length column arrays in batches, one transaction per batch"""
+    names = list(columns)
+    values = [column.tolist() if isinstance(column, np.ndarray) else column for column in columns.values()]
+    total = len(values[0])
+    started = time.perf_counter()
+
+    with engine.connect() as conn:
+        for start in range(0, total, batch_size):
+            rows = [
+                dict(zip(names, row))
+                for row in zip(*(column[start:start + batch_size] for column in values))
+            ]
+            conn.execute(insert(table), rows)
+            conn.commit()
+
+    print(f"Inserted {total} {label} in {time.perf_counter() - started:.1f}s")
+
+def generate_data(
+    users: int,
+    trades: int,
+    orders: int,
+    batch_size: int = 50000,
+    days: int = 90,
+    seed: int = 42,
+    password: str = "password"
+):
+    """Add a large synthetic dataset for load testing.
+
+    Users get all five tokens with an INITIAL_BALANCE ledger row each. About
+    80% of trades are completed between two random users, with the same four
+    ledger legs as trade execution, and the rest stay active. Orders are a
+    mix of completed, cancelled and resting PENDING orders; resting orders
+    are priced above market so the generated books do not cross. Ledger
+    balances are chained per (user, token) with vectorized cumulative sums,
+    and timestamps increase with ids over the last `days` days.
+    """
+    if users < 2:
+        raise ValueError("Generating trades needs at least two users")
+
+    rng = np.random.default_rng(seed)
+    tokens = list(TokenType)
+    token_count = len(tokens)
+    prices = np.array([MARKET_PRICES[token][0] for token in tokens])
+    market_rates = np.divide.outer(prices, prices)
+    end = datetime.utcnow().replace(microsecond=0)
+    start = end - timedelta(days=days)
+    password_hash = get_password_hash(password)
+
+    db = SessionLocal()
+    try:
+        first_user = (db.query(func.max(User.id)).scalar() or 0) + 1
+        first_trade = (db.query(func.max(Trade.id)).scalar() or 0) + 1
+    finally:
+        db.close()
+
+    def timestamps(count: int, after: datetime) -> list:
+        seconds = np.sort(rng.uniform(0, (end - after).total_seconds(), count))
+        return [after + timedelta(seconds=int(second)) for second in seconds]
+
+    def random_pairs(count: int):
+        from_index = rng.integers(0, token_count, count)
+        to_index = (from_index + rng.integers(1, token_count, count)) % token_count
+        return from_index, to_index
+
+    user_ids = np.arange(first_user, first_user + users)
+    _insert_batches(User.__table__, {
+        "id": user_ids,
+        "username": [f"loadtest{user_id}" for user_id in user_ids.tolist()],
+        "email": [f"loadtest{user_id}@example.com" for user_id in user_ids.tolist()],
+        "password_hash": [password_hash] * users,
+        "created_at": [start] * users
+    }, batch_size, "users")
+
+    # Ledger legs in time order: one INITIAL_BALANCE per token, then four per completed trade
+    opening = np.round(rng.lognormal(np.log(100000), 0.5, users * token_count), 6)
+    opening_users = np.repeat(user_ids, token_count)
+    opening_tokens = np.tile(np.arange(token_count), users)
+
+    trade_ids = np.arange(first_trade, first_trade + trades)
+    creators = rng.integers(0, users, trades)
+    executors = (creators + rng.integers(1, max(users, 2), trades)) % users
+    creators, executors = user_ids[creators], user_ids[executors]
+    from_index, to_index = random_pairs(trades)
+    amounts = np.round(rng.exponential(100.0, trades) + 0.01, 6)
+    rates = market_rates[from_index, to_index] * np.exp(rng.normal(0.0, 0.02, trades))
+    completed = rng.random(trades) < 0.8
+    trade_times = timestamps(trades, start + timedelta(seconds=1))
+
+    _insert_batches(Trade.__table__, {
+        "id": trade_ids,
+        "creator_id": creators,
+        "from_token": [tokens[index] for index in from_index.tolist()],
+        "to_token": [tokens[index] for index in to_index.tolist()],
+        "exchange_rate": rates,
+        "amount": amounts,
+        "status": [TradeStatus.COMPLETED if done else TradeStatus.ACTIVE for done in completed.tolist()],
+        "created_at": trade_times,
+        "completed_at": [moment if done else None for moment, done in zip(trade_times, completed.tolist())],
+        "executor_id": [executor if done else None for executor, done in zip(executors.tolist(), completed.tolist())]
+    }, batch_size, "trades")
+
+    done = np.flatnonzero(completed)
+    required = amounts[done] * rates[done]
+    leg_users = np.column_stack([creators[done], creators[done], executors[done], executors[done]]).ravel()
+    leg_tokens = np.column_stack([from_index[done], to_index[done], to_index[done], from_index[done]]).ravel()
+    leg_amounts = np.column_stack([-amounts[done], required, -required, amounts[done]]).ravel()
+    leg_trades = np.repeat(trade_ids[done], 4)
+    leg_types = [TransactionType.TRADE_SEND, TransactionType.TRADE_RECEIVE] * (2 * len(done))
+    leg_times = [moment for index in done.tolist() for moment in [trade_times[index]] * 4]
+
+    keys = np.concatenate([opening_users * token_count + opening_tokens, leg_users * token_count + leg_tokens])
+    changes = np.concatenate([opening, leg_amounts])
+    order = np.argsort(keys, kind="stable")
+    sorted_keys, sorted_changes = keys[order], changes[order]
+    starts = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    after = np.empty_like(changes)
+    after[order] = grouped_cumsum(sorted_changes, starts)
+    before = after - changes
+
+    ledger_users = np.concatenate([opening_users, leg_users])
+    ledger_tokens = np.concatenate([opening_tokens, leg_tokens])
+    descriptions = ["Initial balance"] * len(opening) + [
+        f"Trade #{trade_id}: {'Sent' if amount < 0 else 'Received'} {abs(amount)} {tokens[token].value}"
+        for trade_id, amount, token in zip(leg_trades.tolist(), leg_amounts.tolist(), leg_tokens.tolist())
+    ]
+    _insert_batches(TransactionHistory.__table__, {
+        "user_id": ledger_users,
+        "token_type": [tokens[index] for index in ledger_tokens.tolist()],
+        "transaction_type": [TransactionType.INITIAL_BALANCE] * len(opening) + leg_types,
+        "amount": changes,
+        "balance_before": before,
+        "balance_after": after,
+        "related_trade_id": [None] * len(opening) + leg_trades.tolist(),
+        "description": descriptions,
+        "created_at": [start] * len(opening) + leg_times
+    }, batch_size, "ledger rows")
+
+    final = np.bincount(keys - first_user * token_count, weights=changes, minlength=users * token_count)
+    _insert_batches(Token.__table__, {
+        "user_id": opening_users,
+        "token_type": [tokens[index] for index in opening_tokens.tolist()],
+        "balance": final
+    }, batch_size, "token balances")
+
+    from_index, to_index = random_pairs(orders)
+    status_roll = rng.random(orders)
+    statuses = np.where(status_roll < 0.4, 0, np.where(status_roll < 0.7, 1, 2))
+    order_statuses = [TradeStatus.PENDING, TradeStatus.CANCELLED, TradeStatus.COMPLETED]
+    markup = np.where(statuses == 0, 1.01 + rng.exponential(0.05, orders), np.exp(rng.normal(0.0, 0.02, orders)))
+    order_amounts = np.round(rng.exponential(100.0, orders) + 0.01, 6)
+    order_times = timestamps(orders, start + timedelta(seconds=1))
+    _insert_batches(Order.__table__, {
+        "user_id": user_ids[rng.integers(0, users, orders)],
+        "from_token": [tokens[index] for index in from_index.tolist()],
+        "to_token": [tokens[index] for index in to_index.tolist()],
+        "amount": order_amounts,
+        "filled_amount": np.where(statuses == 2, order_amounts, 0.0),
+        "exchange_rate": market_rates[from_index, to_index] * markup,
+        "status": [order_statuses[index] for index in statuses.tolist()],
+        "created_at": order_times,
+        "matched_at": [moment if status == 2 else None for moment, status in zip(order_times, statuses.tolist())]
+    }, batch_size, "orders")
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Create and seed the database")
+    subcommands = parser.add_subparsers(dest="command")
+    generate = subcommands.add_parser("generate", help="Add a large synthetic dataset for load testing")
+    generate.add_argument("--users", type=int, default=10000)
+    generate.add_argument("--trades", type=int, default=100000)
+    generate.add_argument("--orders", type=int, default=100000)
+    generate.add_argument("--batch-size", type=int, default=50000)
+    generate.add_argument("--days", type=int, default=90, help="Spread timestamps over this many past days")
+    generate.add_argument("--seed", type=int, default=42)
+    generate.add_argument("--password", default="password", help="Password of every generated user")
+    args = parser.parse_args()
+
     create_tables()
     seed_data()
+    if args.command == "generate":
+        generate_data(
+            users=args.users,
+            trades=args.trades,
+            orders=args.orders,
+            batch_size=args.batch_size,
+            days=args.days,
+            seed=args.seed,
+            password=args.password
+        )
@@ -11,7 +11,16 @@ from routes.conversion import router as conversion_router
 from routes.proxy import router as proxy_router
 from routes.api_keys import router as api_keys_router
 from routes.orders import router as orders_router
+from routes.stream import router as stream_router
 from init_db import create_tables, seed_data
+from services.matching_engine import matching_engine
+from services.order_journal import order_journal
+from services.balance_snapshots import balance_snapshots
+from services.history_archive import history_archive
+from services.conversion_service import conversion_stats, cross_rates
+from services.price_feed import price_feed
+from services.stream_hub import stream_hub
+from database import SessionLocal
 
 app = FastAPI(
     title="Tokenomics Trading Platform",
@@ -25,6 +34,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Transaction history pagination hands out the next cursor in this header
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(auth_router)
@@ -37,6 +48,7 @@ app.include_router(conversion_router)
 app.include_router(proxy_router)
 app.include_router(api_keys_router)
 app.include_router(orders_router)
+app.include_router(stream_router)
 
 app.mount("/assets", StaticFiles(directory="assets"), name="assets")
 app.mount("/styles", StaticFiles(directory="styles"), name="styles") 
@@ -47,6 +59,32 @@ app.mount("/", StaticFiles(directory=".", html=True), name="static")
 async def startup_event():
     create_tables()
     seed_data()
+    
+    if order_journal.enabled:
+        db = SessionLocal()
+        try:
+            order_journal.recover(db)
+        finally:
+            db.close()
+    
+    await stream_hub.start()
+    await matching_engine.start()
+    await balance_snapshots.start()
+    await history_archive.start()
+    await conversion_stats.start()
+    await cross_rates.start()
+    await price_feed.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await price_feed.stop()
+    await cross_rates.stop()
+    await conversion_stats.stop()
+    await history_archive.stop()
+    await balance_snapshots.stop()
+    await matching_engine.stop()
+    await stream_hub.stop()
+    order_journal.close()
 
 @app.get("/")
 def read_root():
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Date, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Date, Boolean, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -24,6 +24,11 @@ class TransactionType(enum.Enum):
     WITHDRAWAL = "withdrawal"
     INITIAL_BALANCE = "initial_balance"
 
+class BalanceResolution(enum.Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
 class User(Base):
     __tablename__ = "users"
     
@@ -72,6 +77,22 @@ class MarketPrice(Base):
     price_usd = Column(Float, nullable=False)
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class MarketPriceHistory(Base):
+    """Append-only log of applied market price ticks"""
+    __tablename__ = "market_price_history"
+
+    id = Column(Integer, primary_key=True, index=True)
+    token_type = Column(Enum(TokenType), nullable=False)
+    price_btc = Column(Float, nullable=False)
+    price_usd = Column(Float, nullable=False)
+    tick_count = Column(Integer, nullable=False, default=1)
+    recorded_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_market_price_history_token_recorded", "token_type", "recorded_at"),
+    )
+
 class TransactionHistory(Base):
     __tablename__ = "transaction_history"
     
@@ -89,6 +110,12 @@ class TransactionHistory(Base):
     user = relationship("User")
     related_trade = relationship("Trade")
 
+    # Keyset pagination walks (created_at, id) newest first, with or without a token filter
+    __table_args__ = (
+        Index("ix_transaction_history_user_token_created", "user_id", "token_type", "created_at", "id"),
+        Index("ix_transaction_history_user_created", "user_id", "created_at", "id"),
+    )
+
 class BalanceSnapshot(Base):
     __tablename__ = "balance_snapshots"
     
@@ -101,6 +128,32 @@ class BalanceSnapshot(Base):
     
     user = relationship("User")
 
+    __table_args__ = (
+        Index("ix_balance_snapshots_user_token_date", "user_id", "token_type", "snapshot_date"),
+    )
+
+class BalanceRollup(Base):
+    """Open/high/low/close of daily balance snapshots over a week or month"""
+    __tablename__ = "balance_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    token_type = Column(Enum(TokenType), nullable=False)
+    resolution = Column(Enum(BalanceResolution), nullable=False)
+    period_start = Column(Date, nullable=False)
+    first_date = Column(Date, nullable=False)
+    last_date = Column(Date, nullable=False)
+    open = Column(Float, nullable=False)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    close = Column(Float, nullable=False)
+    
+    user = relationship("User")
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "resolution", "token_type", "period_start", name="uq_balance_rollups_period"),
+    )
+
 class ConversionRate(Base):
     __tablename__ = "conversion_rates"
     
@@ -113,6 +166,22 @@ class ConversionRate(Base):
     spread_percentage = Column(Float, nullable=True)
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class ConversionVolumeBucket(Base):
+    """Traded volume of a token pair within one minute (minutes since the Unix epoch)"""
+    __tablename__ = "conversion_volume_buckets"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    from_token = Column(Enum(TokenType), nullable=False)
+    to_token = Column(Enum(TokenType), nullable=False)
+    minute = Column(Integer, nullable=False)
+    volume = Column(Float, nullable=False)
+    notional = Column(Float, nullable=False)
+    trade_count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("from_token", "to_token", "minute", name="uq_conversion_volume_buckets_minute"),
+    )
+
 class UserType(enum.Enum):
     SELLER = "seller"
     BUYER = "buyer"
@@ -138,6 +207,7 @@ class Order(Base):
     from_token = Column(Enum(TokenType), nullable=False)
     to_token = Column(Enum(TokenType), nullable=False)
     amount = Column(Float, nullable=False)
+    filled_amount = Column(Float, default=0.0, nullable=False)
     exchange_rate = Column(Float, nullable=False)
     status = Column(Enum(TradeStatus), default=TradeStatus.PENDING, nullable=False)
     matched_order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
@@ -146,3 +216,8 @@ class Order(Base):
     
     user = relationship("User")
     matched_order = relationship("Order", remote_side=[id])
+
+    # Counting PENDING orders (journal recovery) and loading them should not scan the table
+    __table_args__ = (
+        Index("ix_orders_status", "status"),
+    )
@@ -1,18 +1,106 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
 from typing import List
 from database import get_db
-from models import TokenType, ConversionRate
-from schemas import ConversionRate as ConversionRateSchema
+from models import TokenType
+from schemas import (
+    ConversionRate as ConversionRateSchema, RateMatrix, QuoteBatchRequest, QuoteBatchResponse, Quote,
+    BestConversionPath, ConversionCycle
+)
 from services import ConversionService
+from services.conversion_service import TOKEN_INDEX, cross_rates, conversion_stats, current_minute
+from services.conversion_router import conversion_router
+from http_cache import VersionedResponse
+import numpy as np
 
 router = APIRouter(prefix="/api/conversion", tags=["conversion"])
 
+_conversion_rates_adapter = TypeAdapter(List[ConversionRateSchema])
+_conversion_rates_response = VersionedResponse()
+
 @router.get("/rates", response_model=List[ConversionRateSchema])
-def get_conversion_rates(db: Session = Depends(get_db)):
+def get_conversion_rates(request: Request, db: Session = Depends(get_db)):
     """Get all conversion rates"""
-    rates = db.query(ConversionRate).all()
-    return rates
+    # Prices, committed trades and the rolling 24h window (per minute) are all it depends on
+    return _conversion_rates_response.respond(
+        request, (cross_rates.version, conversion_stats.version, current_minute()),
+        lambda: _conversion_rates_adapter.dump_json(_conversion_rates(db))
+    )
+
+def _conversion_rates(db: Session) -> List[ConversionRateSchema]:
+    rates = ConversionService.get_rate_matrix(db)
+    return [
+        ConversionRateSchema(
+            from_token=stats.from_token,
+            to_token=stats.to_token,
+            market_rate=rates[TOKEN_INDEX[stats.from_token], TOKEN_INDEX[stats.to_token]],
+            avg_trade_rate=stats.avg_trade_rate,
+            volume_24h=stats.volume_24h,
+            spread_percentage=stats.spread_percentage,
+            last_updated=stats.last_updated
+        )
+        for stats in ConversionService.list_conversion_stats(db)
+        if not np.isnan(rates[TOKEN_INDEX[stats.from_token], TOKEN_INDEX[stats.to_token]])
+    ]
+
+@router.get("/matrix", response_model=RateMatrix)
+def get_rate_matrix(db: Session = Depends(get_db)):
+    """Get market rates between every pair of tokens: rates[i][j] converts tokens[i] to tokens[j]"""
+    rates = ConversionService.get_rate_matrix(db)
+    return RateMatrix(
+        tokens=list(TokenType),
+        rates=np.where(np.isnan(rates), None, rates).tolist()
+    )
+
+@router.post("/quotes", response_model=QuoteBatchResponse)
+def get_quotes(batch: QuoteBatchRequest, db: Session = Depends(get_db)):
+    """Quote many (from_token, to_token, amount) conversions at once"""
+    market_rates, avg_rates, outputs = ConversionService.quote(
+        [(quote.from_token, quote.to_token, quote.amount) for quote in batch.quotes], db
+    )
+
+    def value(number: float):
+        return None if np.isnan(number) else float(number)
+
+    return QuoteBatchResponse(quotes=[
+        Quote(
+            from_token=request.from_token,
+            to_token=request.to_token,
+            amount=request.amount,
+            market_rate=value(market_rate),
+            avg_trade_rate=value(avg_rate),
+            estimated_output=value(output)
+        )
+        for request, market_rate, avg_rate, output in zip(batch.quotes, market_rates, avg_rates, outputs)
+    ])
+
+@router.get("/best-path/{from_token}/{to_token}", response_model=BestConversionPath)
+def get_best_path(
+    from_token: TokenType,
+    to_token: TokenType,
+    db: Session = Depends(get_db)
+):
+    """Get the highest-rate conversion path, possibly via other tokens, and any arbitrage cycles"""
+    path = conversion_router.best_path(from_token, to_token, db)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No conversion path from {from_token.value} to {to_token.value}"
+        )
+
+    direct_rate = ConversionService.get_rate_matrix(db)[TOKEN_INDEX[from_token], TOKEN_INDEX[to_token]]
+    return BestConversionPath(
+        from_token=from_token,
+        to_token=to_token,
+        path=list(path.tokens),
+        rate=path.rate,
+        direct_rate=None if np.isnan(direct_rate) else float(direct_rate),
+        arbitrage=[
+            ConversionCycle(tokens=list(cycle.tokens), rate=cycle.rate)
+            for cycle in conversion_router.arbitrage_cycles(db)
+        ]
+    )
 
 @router.get("/rate/{from_token}/{to_token}")
 def get_conversion_rate(
@@ -23,16 +111,16 @@ def get_conversion_rate(
     """Get conversion rate between two specific tokens"""
     try:
         market_rate = ConversionService.calculate_market_rate(from_token, to_token, db)
-        conversion_rate = ConversionService.get_or_create_conversion_rate(from_token, to_token, db)
+        stats = ConversionService.get_conversion_stats(from_token, to_token, db)
         
         return {
             "from_token": from_token,
             "to_token": to_token,
             "market_rate": market_rate,
-            "avg_trade_rate": conversion_rate.avg_trade_rate,
-            "volume_24h": conversion_rate.volume_24h,
-            "spread_percentage": conversion_rate.spread_percentage,
-            "last_updated": conversion_rate.last_updated
+            "avg_trade_rate": stats.avg_trade_rate,
+            "volume_24h": stats.volume_24h,
+            "spread_percentage": stats.spread_percentage,
+            "last_updated": stats.last_updated
         }
     except ValueError as e:
         raise HTTPException(
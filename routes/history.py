@@ -1,43 +1,117 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Iterator, List, Optional, Union
 from database import get_db
-from models import User, TokenType
-from schemas import TransactionHistory, BalanceSnapshot
+from models import User, TokenType, BalanceResolution
+from schemas import TransactionHistory, BalanceSnapshot, BalanceRollup
 from auth import get_current_user
 from services import TransactionService
+import csv
+import enum
+import io
+import json
 
 router = APIRouter(prefix="/api/history", tags=["history"])
 
 @router.get("/transactions", response_model=List[TransactionHistory])
 def get_transaction_history(
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
     token_type: Optional[TokenType] = Query(None, description="Filter by token type"),
-    limit: int = Query(100, ge=1, le=1000, description="Number of transactions to return")
+    limit: int = Query(100, ge=1, le=1000, description="Number of transactions to return"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page")
 ):
-    """Get transaction history for the current user"""
-    transactions = TransactionService.get_user_transaction_history(
-        user_id=current_user.id,
-        db=db,
-        token_type=token_type,
-        limit=limit
-    )
+    """Get transaction history for the current user, newest first.
+
+    When more rows may follow, the X-Next-Cursor response header holds the
+    cursor for the next page.
+    """
+    try:
+        transactions = TransactionService.get_user_transaction_history(
+            user_id=current_user.id,
+            db=db,
+            token_type=token_type,
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(transactions) == limit:
+        response.headers["X-Next-Cursor"] = TransactionService.encode_cursor(transactions[-1])
     return transactions
 
-@router.get("/balances", response_model=List[BalanceSnapshot])
+EXPORT_FIELDS = [
+    "id", "created_at", "token_type", "transaction_type", "amount",
+    "balance_before", "balance_after", "related_trade_id", "description"
+]
+
+def _export_value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+def _ndjson_chunks(batches: Iterator[list]) -> Iterator[str]:
+    for rows in batches:
+        yield "".join(
+            json.dumps({field: _export_value(value) for field, value in zip(EXPORT_FIELDS, row)}) + "\n"
+            for row in rows
+        )
+
+def _csv_chunks(batches: Iterator[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for rows in batches:
+        writer.writerows([_export_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@router.get("/transactions/export")
+def export_transaction_history(
+    current_user: User = Depends(get_current_user),
+    token_type: Optional[TokenType] = Query(None, description="Filter by token type"),
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="ndjson or csv")
+):
+    """Stream the complete transaction history of the current user, oldest first"""
+    batches = TransactionService.iter_user_transaction_batches(current_user.id, token_type=token_type)
+
+    if export_format == "csv":
+        body, media_type = _csv_chunks(batches), "text/csv"
+    else:
+        body, media_type = _ndjson_chunks(batches), "application/x-ndjson"
+
+    filename = f"transactions-{current_user.id}.{export_format}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/balances", response_model=Union[List[BalanceSnapshot], List[BalanceRollup]])
 def get_balance_history(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
     token_type: Optional[TokenType] = Query(None, description="Filter by token type"),
-    days: int = Query(30, ge=1, le=365, description="Number of days of history to return")
+    days: int = Query(30, ge=1, le=365, description="Number of days of history to return"),
+    resolution: BalanceResolution = Query(
+        BalanceResolution.DAY, description="day for raw snapshots, week or month for OHLC rollups"
+    )
 ):
-    """Get balance history snapshots for the current user"""
+    """Get balance history snapshots (or weekly/monthly rollups) for the current user"""
     snapshots = TransactionService.get_user_balance_history(
         user_id=current_user.id,
         db=db,
         token_type=token_type,
-        days=days
+        days=days,
+        resolution=resolution
     )
     return snapshots
 
@@ -1,13 +1,36 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Request
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
 from typing import List
 from database import get_db
-from models import MarketPrice
-from schemas import MarketPrice as MarketPriceSchema
+from models import MarketPrice, MarketPriceHistory, TokenType
+from schemas import MarketPrice as MarketPriceSchema, MarketPriceHistory as MarketPriceHistorySchema
+from http_cache import VersionedResponse
+from services.conversion_service import cross_rates
 
 router = APIRouter(prefix="/api/market", tags=["market"])
 
+_market_prices_adapter = TypeAdapter(List[MarketPriceSchema])
+_market_prices_response = VersionedResponse()
+
 @router.get("/prices", response_model=List[MarketPriceSchema])
-def get_market_prices(db: Session = Depends(get_db)):
-    prices = db.query(MarketPrice).all()
-    return prices
+def get_market_prices(request: Request, db: Session = Depends(get_db)):
+    # cross_rates.version is bumped by every committed market_prices change, including
+    # ones a standalone price feed makes (seen by the cross-rate poll)
+    return _market_prices_response.respond(
+        request, cross_rates.version,
+        lambda: _market_prices_adapter.dump_json(db.query(MarketPrice).all())
+    )
+
+@router.get("/prices/{token_type}/history", response_model=List[MarketPriceHistorySchema])
+def get_market_price_history(
+    token_type: TokenType,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    return db.query(MarketPriceHistory).filter(
+        MarketPriceHistory.token_type == token_type
+    ).order_by(
+        MarketPriceHistory.recorded_at.desc(),
+        MarketPriceHistory.id.desc()
+    ).limit(limit).all()
@@ -1,19 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from typing import List
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import time
 from database import get_db
-from models import User, Order, TradeStatus, Token
-from schemas import OrderCreate, OrderResponse
+from models import User, Order, TradeStatus, Token, TokenType
+from schemas import (
+    OrderCreate, OrderResponse, OrderBookDepth, OrderBookLevel,
+    OrderBatchCreate, OrderBatchCancel, OrderBatchResult, OrderBatchResponse
+)
 from auth import get_current_user
-from services.order_matching_service import OrderMatchingService
+from services.matching_engine import matching_engine
+from services.order_book import order_books
 
 router = APIRouter(prefix="/api/orders", tags=["orders"])
 
+ENGINE_WAIT_TIMEOUT = 10.0
+
 @router.post("/create", response_model=OrderResponse)
 def create_order(
     order_data: OrderCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    wait: bool = Query(False, description="Wait for the matching engine to process the order")
 ):
     if order_data.from_token == order_data.to_token:
         raise HTTPException(
@@ -41,13 +50,25 @@ def create_order(
     )
     
     db.add(order)
-    db.flush()
-    
-    matched_trade = OrderMatchingService.process_order(order, db)
-    
     db.commit()
     db.refresh(order)
     
+    fill = matching_engine.submit(order)
+    
+    if wait:
+        try:
+            fill.result(timeout=ENGINE_WAIT_TIMEOUT)
+        except (FutureTimeoutError, LookupError):
+            # A LookupError means an earlier queued command already filled or cancelled
+            # the committed order; the refreshed order below reports its status
+            pass
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+        db.refresh(order)
+    
     return order
 
 @router.get("/list", response_model=List[OrderResponse])
@@ -61,6 +82,127 @@ def list_orders(
     
     return orders
 
+@router.get("/book/{from_token}/{to_token}", response_model=OrderBookDepth)
+def get_order_book(
+    from_token: TokenType,
+    to_token: TokenType,
+    levels: int = Query(10, ge=1, le=100, description="Number of price levels to return"),
+    db: Session = Depends(get_db)
+):
+    """Aggregated resting orders selling from_token for to_token, best rate first"""
+    with order_books.lock:
+        depth = order_books.book(from_token, to_token, db).depth(levels)
+    
+    return OrderBookDepth(
+        from_token=from_token,
+        to_token=to_token,
+        levels=[
+            OrderBookLevel(exchange_rate=rate, amount=amount, order_count=count)
+            for rate, amount, count in depth
+        ]
+    )
+
+@router.post("/batch", response_model=OrderBatchResponse)
+def create_orders_batch(
+    batch: OrderBatchCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    wait: bool = Query(False, description="Wait for the matching engine to process the orders")
+):
+    """Submit many orders with one balance check per token and a single commit"""
+    available = {
+        token.token_type: token.balance
+        for token in db.query(Token).filter(Token.user_id == current_user.id).all()
+    }
+    
+    results = []
+    accepted = []
+    for order_data in batch.orders:
+        if order_data.from_token == order_data.to_token:
+            results.append(OrderBatchResult(status="rejected", detail="Cannot trade the same token type"))
+            continue
+        
+        if available.get(order_data.from_token, 0.0) < order_data.amount:
+            results.append(OrderBatchResult(status="rejected", detail="Insufficient balance for order"))
+            continue
+        
+        available[order_data.from_token] -= order_data.amount
+        order = Order(
+            user_id=current_user.id,
+            from_token=order_data.from_token,
+            to_token=order_data.to_token,
+            amount=order_data.amount,
+            exchange_rate=order_data.exchange_rate
+        )
+        results.append(OrderBatchResult(status="accepted"))
+        accepted.append((results[-1], order))
+    
+    db.add_all([order for _, order in accepted])
+    db.commit()
+    
+    fills = [(result, order, matching_engine.submit(order)) for result, order in accepted]
+    
+    deadline = time.monotonic() + ENGINE_WAIT_TIMEOUT
+    for result, order, fill in fills:
+        if wait:
+            try:
+                fill.result(timeout=max(deadline - time.monotonic(), 0.0))
+            except FutureTimeoutError:
+                pass
+            except ValueError as e:
+                result.status = "rejected"
+                result.detail = str(e)
+            except LookupError as e:
+                # Already filled or cancelled by an earlier queued command; the order shows which
+                result.detail = str(e)
+            except Exception as e:
+                # The order is committed either way, so one failed match must not fail the batch
+                result.status = "failed"
+                result.detail = str(e)
+            db.refresh(order)
+        
+        result.order_id = order.id
+        result.order = OrderResponse.model_validate(order)
+    
+    return OrderBatchResponse(results=results)
+
+@router.delete("/batch", response_model=OrderBatchResponse)
+def cancel_orders_batch(
+    batch: OrderBatchCancel,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Cancel many orders in one request"""
+    orders = db.query(Order).filter(
+        Order.id.in_(batch.order_ids),
+        Order.user_id == current_user.id,
+        Order.status == TradeStatus.PENDING
+    ).all()
+    
+    cancellations = {order.id: matching_engine.cancel(order) for order in orders}
+    
+    results = []
+    deadline = time.monotonic() + ENGINE_WAIT_TIMEOUT
+    for order_id in batch.order_ids:
+        cancellation = cancellations.get(order_id)
+        if cancellation is None:
+            results.append(OrderBatchResult(
+                order_id=order_id, status="not_found", detail="Order not found or cannot be cancelled"
+            ))
+            continue
+        
+        try:
+            cancellation.result(timeout=max(deadline - time.monotonic(), 0.0))
+            results.append(OrderBatchResult(order_id=order_id, status="cancelled"))
+        except FutureTimeoutError:
+            results.append(OrderBatchResult(order_id=order_id, status="queued"))
+        except LookupError:
+            results.append(OrderBatchResult(
+                order_id=order_id, status="not_found", detail="Order not found or cannot be cancelled"
+            ))
+    
+    return OrderBatchResponse(results=results)
+
 @router.delete("/{order_id}")
 def cancel_order(
     order_id: int,
@@ -79,7 +221,14 @@ def cancel_order(
             detail="Order not found or cannot be cancelled"
         )
     
-    order.status = TradeStatus.CANCELLED
-    db.commit()
+    try:
+        matching_engine.cancel(order).result(timeout=ENGINE_WAIT_TIMEOUT)
+    except FutureTimeoutError:
+        return {"message": "Order cancellation queued"}
+    except LookupError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Order not found or cannot be cancelled"
+        )
     
     return {"message": "Order cancelled successfully"}
@@ -0,0 +1,140 @@
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from database import SessionLocal
+from models import User
+from auth import verify_token
+from services.stream_hub import (
+    stream_hub, Subscription, PRICES, ORDERS, parse_book_topic, orders_topic
+)
+import asyncio
+
+router = APIRouter(prefix="/api/stream", tags=["stream"])
+
+SSE_HEARTBEAT_SECONDS = 15.0
+
+def _authenticate(token: Optional[str]) -> Optional[int]:
+    """User id for a bearer token, checked once per connection"""
+    if token is None:
+        return None
+    username = verify_token(token)
+    if username is None:
+        return None
+    db = SessionLocal()
+    try:
+        user = db.query(User.id).filter(User.username == username).first()
+        return user.id if user else None
+    finally:
+        db.close()
+
+def _topic(channel: str, user_id: Optional[int]) -> str:
+    """Hub topic for a client channel: "prices", "book:<from>:<to>" or "orders" (requires a token)"""
+    if not isinstance(channel, str):
+        raise ValueError("Channels must be strings")
+    if channel == PRICES:
+        return PRICES
+    if channel == ORDERS:
+        if user_id is None:
+            raise ValueError("The orders channel requires a token")
+        return orders_topic(user_id)
+    if parse_book_topic(channel) is not None:
+        return channel
+    raise ValueError(f"Unknown channel: {channel}")
+
+@router.websocket("/ws")
+async def stream_websocket(websocket: WebSocket, token: Optional[str] = Query(None)):
+    """Push channel; send {"subscribe": [...]} or {"unsubscribe": [...]} with channel names"""
+    loop = asyncio.get_running_loop()
+    user_id = await loop.run_in_executor(None, _authenticate, token)
+    if token is not None and user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    subscription = Subscription(stream_hub.queue_size)
+
+    async def send():
+        while True:
+            message = await subscription.queue.get()
+            if message is None:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            await websocket.send_text(message)
+
+    sender = asyncio.create_task(send())
+    try:
+        while True:
+            request = await websocket.receive_json()
+            if not isinstance(request, dict):
+                await websocket.send_json({"error": "Expected an object with subscribe or unsubscribe lists"})
+                continue
+            for action, subscribe in (("subscribe", True), ("unsubscribe", False)):
+                channels = request.get(action, [])
+                if not isinstance(channels, list):
+                    await websocket.send_json({"error": f"{action} must be a list of channels"})
+                    continue
+                for channel in channels:
+                    try:
+                        topic = _topic(channel, user_id)
+                    except ValueError as e:
+                        await websocket.send_json({"channel": channel, "error": str(e)})
+                        continue
+                    if subscribe:
+                        stream_hub.subscribe(subscription, topic)
+                    else:
+                        stream_hub.unsubscribe(subscription, topic)
+    except (WebSocketDisconnect, ValueError, RuntimeError):
+        pass
+    finally:
+        stream_hub.unsubscribe(subscription)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    channels: str = Query(..., description="Comma-separated channels: prices, book:<from>:<to>, orders"),
+    token: Optional[str] = Query(None, description="Access token, required for the orders channel")
+):
+    """Server-sent events fallback of the WebSocket stream"""
+    loop = asyncio.get_running_loop()
+    user_id = await loop.run_in_executor(None, _authenticate, token)
+    if token is not None and user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials"
+        )
+
+    try:
+        topics: List[str] = [_topic(channel.strip(), user_id) for channel in channels.split(",") if channel.strip()]
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    subscription = Subscription(stream_hub.queue_size)
+    for topic in topics:
+        stream_hub.subscribe(subscription, topic)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield f"data: {message}\n\n"
+        finally:
+            stream_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
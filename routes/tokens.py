@@ -1,7 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from pydantic import TypeAdapter
 from typing import List
 from models import TokenType
 from schemas import TokenTypeInfo
+from http_cache import cached_json, strong_etag
 
 router = APIRouter(prefix="/api/tokens", tags=["tokens"])
 
@@ -33,6 +35,9 @@ TOKEN_INFO = {
     )
 }
 
+TOKEN_TYPES_JSON = TypeAdapter(List[TokenTypeInfo]).dump_json(list(TOKEN_INFO.values()))
+TOKEN_TYPES_ETAG = strong_etag(TOKEN_TYPES_JSON)
+
 @router.get("/types", response_model=List[TokenTypeInfo])
-def get_token_types():
-    return list(TOKEN_INFO.values())
+def get_token_types(request: Request):
+    return cached_json(TOKEN_TYPES_JSON, TOKEN_TYPES_ETAG, "public, max-age=86400", request)
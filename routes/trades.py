@@ -5,7 +5,7 @@ from database import get_db
 from models import User, Token, Trade, TradeStatus, TransactionType
 from schemas import TradeCreate, TradeExecute, Trade as TradeSchema, TradeCreateEnhanced
 from auth import get_current_user
-from services import ConversionService, TransactionService
+from services import ConversionService, TransactionService, BalanceLeg
 from datetime import datetime
 
 router = APIRouter(prefix="/api/trades", tags=["trades"])
@@ -120,45 +120,24 @@ def execute_trade(
     required_amount = trade.amount * trade.exchange_rate
     
     try:
-        TransactionService.update_balance_with_history(
-            user_id=trade.creator_id,
-            token_type=trade.from_token,
-            amount_change=-trade.amount,
-            transaction_type=TransactionType.TRADE_SEND,
-            db=db,
-            related_trade_id=trade.id,
-            description=f"Trade #{trade.id}: Sent {trade.amount} {trade.from_token.value}"
-        )
-        
-        TransactionService.update_balance_with_history(
-            user_id=trade.creator_id,
-            token_type=trade.to_token,
-            amount_change=required_amount,
-            transaction_type=TransactionType.TRADE_RECEIVE,
-            db=db,
-            related_trade_id=trade.id,
-            description=f"Trade #{trade.id}: Received {required_amount} {trade.to_token.value}"
-        )
-        
-        TransactionService.update_balance_with_history(
-            user_id=current_user.id,
-            token_type=trade.to_token,
-            amount_change=-required_amount,
-            transaction_type=TransactionType.TRADE_SEND,
-            db=db,
-            related_trade_id=trade.id,
-            description=f"Trade #{trade.id}: Sent {required_amount} {trade.to_token.value}"
-        )
-        
-        TransactionService.update_balance_with_history(
-            user_id=current_user.id,
-            token_type=trade.from_token,
-            amount_change=trade.amount,
-            transaction_type=TransactionType.TRADE_RECEIVE,
-            db=db,
-            related_trade_id=trade.id,
-            description=f"Trade #{trade.id}: Received {trade.amount} {trade.from_token.value}"
-        )
+        TransactionService.apply_balance_legs([
+            BalanceLeg(
+                trade.creator_id, trade.from_token, -trade.amount, TransactionType.TRADE_SEND,
+                f"Trade #{trade.id}: Sent {trade.amount} {trade.from_token.value}"
+            ),
+            BalanceLeg(
+                trade.creator_id, trade.to_token, required_amount, TransactionType.TRADE_RECEIVE,
+                f"Trade #{trade.id}: Received {required_amount} {trade.to_token.value}"
+            ),
+            BalanceLeg(
+                current_user.id, trade.to_token, -required_amount, TransactionType.TRADE_SEND,
+                f"Trade #{trade.id}: Sent {required_amount} {trade.to_token.value}"
+            ),
+            BalanceLeg(
+                current_user.id, trade.from_token, trade.amount, TransactionType.TRADE_RECEIVE,
+                f"Trade #{trade.id}: Received {trade.amount} {trade.from_token.value}"
+            ),
+        ], db, related_trade_id=trade.id)
         
         trade.status = TradeStatus.COMPLETED
         trade.executor_id = current_user.id
@@ -168,9 +147,6 @@ def execute_trade(
             trade.from_token, trade.to_token, trade.exchange_rate, trade.amount, db
         )
         
-        TransactionService.create_daily_balance_snapshot(trade.creator_id, db)
-        TransactionService.create_daily_balance_snapshot(current_user.id, db)
-        
         db.commit()
         db.refresh(trade)
         
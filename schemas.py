@@ -1,7 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional
 from datetime import datetime, date
-from models import TokenType, TradeStatus, TransactionType, UserType
+from models import TokenType, TradeStatus, TransactionType, UserType, BalanceResolution
 
 class UserCreate(BaseModel):
     username: str
@@ -71,6 +71,16 @@ class MarketPrice(BaseModel):
     class Config:
         from_attributes = True
 
+class MarketPriceHistory(BaseModel):
+    token_type: TokenType
+    price_btc: float
+    price_usd: float
+    tick_count: int
+    recorded_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 class AuthToken(BaseModel):
     access_token: str
     token_type: str = "bearer"
@@ -102,6 +112,53 @@ class BalanceSnapshot(BaseModel):
     class Config:
         from_attributes = True
 
+class BalanceRollup(BaseModel):
+    token_type: TokenType
+    resolution: BalanceResolution
+    period_start: date
+    open: float
+    high: float
+    low: float
+    close: float
+    
+    class Config:
+        from_attributes = True
+
+class RateMatrix(BaseModel):
+    tokens: List[TokenType]
+    rates: List[List[Optional[float]]]
+
+class QuoteRequest(BaseModel):
+    from_token: TokenType
+    to_token: TokenType
+    amount: float = Field(..., gt=0)
+
+class QuoteBatchRequest(BaseModel):
+    quotes: List[QuoteRequest] = Field(..., min_length=1, max_length=500)
+
+class Quote(BaseModel):
+    from_token: TokenType
+    to_token: TokenType
+    amount: float
+    market_rate: Optional[float] = None
+    avg_trade_rate: Optional[float] = None
+    estimated_output: Optional[float] = None
+
+class QuoteBatchResponse(BaseModel):
+    quotes: List[Quote]
+
+class ConversionCycle(BaseModel):
+    tokens: List[TokenType]
+    rate: float
+
+class BestConversionPath(BaseModel):
+    from_token: TokenType
+    to_token: TokenType
+    path: List[TokenType]
+    rate: float
+    direct_rate: Optional[float] = None
+    arbitrage: List[ConversionCycle] = []
+
 class ConversionRate(BaseModel):
     from_token: TokenType
     to_token: TokenType
@@ -149,6 +206,7 @@ class OrderResponse(BaseModel):
     from_token: TokenType
     to_token: TokenType
     amount: float
+    filled_amount: float = 0.0
     exchange_rate: float
     status: TradeStatus
     matched_order_id: Optional[int]
@@ -158,6 +216,31 @@ class OrderResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class OrderBatchCreate(BaseModel):
+    orders: List[OrderCreate] = Field(..., min_length=1, max_length=500)
+
+class OrderBatchCancel(BaseModel):
+    order_ids: List[int] = Field(..., min_length=1, max_length=500)
+
+class OrderBatchResult(BaseModel):
+    order_id: Optional[int] = None
+    status: str
+    detail: Optional[str] = None
+    order: Optional[OrderResponse] = None
+
+class OrderBatchResponse(BaseModel):
+    results: List[OrderBatchResult]
+
+class OrderBookLevel(BaseModel):
+    exchange_rate: float
+    amount: float
+    order_count: int
+
+class OrderBookDepth(BaseModel):
+    from_token: TokenType
+    to_token: TokenType
+    levels: List[OrderBookLevel]
+
 class ProxyRequest(BaseModel):
     endpoint: str
     method: str = "POST"
@@ -159,6 +159,14 @@ class ApiService {
         return await response.json();
     }
 
+    openStream(channels) {
+        const params = new URLSearchParams({ channels: channels.join(',') });
+        if (this.token) {
+            params.set('token', this.token);
+        }
+        return new EventSource(`${this.baseURL}/api/stream/events?${params}`);
+    }
+
     async addApiKey(tokenType, apiKey, userType = 'seller') {
         const response = await fetch(`${this.baseURL}/api/seller/keys/register`, {
             method: 'POST',
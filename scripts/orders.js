@@ -1,13 +1,47 @@
 class OrderManager {
     constructor() {
         this.ordersContainer = document.getElementById('ordersList');
+        this.stream = null;
+        this.streamToken = null;
+        this.reloadTimer = null;
         this.loadOrders();
+        this.connectStream();
         
-        setInterval(() => {
-            if (window.apiService && window.apiService.token) {
-                this.loadOrders();
-            }
-        }, 5000);
+        // Order and fill events are pushed; this only notices login and logout
+        setInterval(() => this.connectStream(), 1000);
+    }
+    
+    connectStream() {
+        const token = window.apiService ? window.apiService.token : null;
+        if (token === this.streamToken) {
+            return;
+        }
+        
+        if (this.stream) {
+            this.stream.close();
+            this.stream = null;
+        }
+        this.streamToken = token;
+        
+        if (!token || !window.EventSource) {
+            this.loadOrders();
+            return;
+        }
+        
+        this.stream = window.apiService.openStream(['orders']);
+        this.stream.onopen = () => this.loadOrders();
+        this.stream.onmessage = () => this.scheduleReload();
+    }
+    
+    scheduleReload() {
+        // A fill touches several orders at once; reload once per burst
+        if (this.reloadTimer) {
+            return;
+        }
+        this.reloadTimer = setTimeout(() => {
+            this.reloadTimer = null;
+            this.loadOrders();
+        }, 250);
     }
     
     async loadOrders() {
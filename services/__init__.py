@@ -1,4 +1,4 @@
-from .transaction_service import TransactionService
+from .transaction_service import TransactionService, BalanceLeg
 from .conversion_service import ConversionService
 
-__all__ = ['TransactionService', 'ConversionService']
+__all__ = ['TransactionService', 'BalanceLeg', 'ConversionService']
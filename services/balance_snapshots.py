@@ -0,0 +1,84 @@
+from sqlalchemy import func
+from database import SessionLocal
+from models import BalanceRollup, BalanceSnapshot
+from services.transaction_service import TransactionService
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+BALANCE_SNAPSHOTS_ENABLED = os.getenv("BALANCE_SNAPSHOTS_ENABLED", "true").lower() == "true"
+BALANCE_SNAPSHOT_BACKFILL_DAYS = int(os.getenv("BALANCE_SNAPSHOT_BACKFILL_DAYS", "365"))
+
+class BalanceSnapshotScheduler:
+    """Takes the daily balance snapshots of all users in the background.
+
+    Runs at startup and then just after every UTC midnight. Each run fills in
+    every day since the latest snapshot (up to backfill_days back), one
+    set-based insert per day, so downtime does not leave gaps.
+    """
+
+    def __init__(self, enabled: bool = True, backfill_days: int = 365):
+        self.enabled = enabled
+        self.backfill_days = backfill_days
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info("Balance snapshot scheduler started")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.run_once)
+            except Exception:
+                logger.exception("Daily balance snapshot failed")
+
+            now = datetime.now(timezone.utc)
+            next_run = datetime.combine(now.date() + timedelta(days=1), time(second=1), timezone.utc)
+            await asyncio.sleep((next_run - now).total_seconds())
+
+    def run_once(self, today: Optional[date] = None) -> int:
+        """Snapshot today and any missed days before it, returning the rows inserted"""
+        today = today or datetime.now(timezone.utc).date()
+        db = SessionLocal()
+        try:
+            latest = db.query(func.max(BalanceSnapshot.snapshot_date)).scalar()
+            if latest is not None and db.query(BalanceRollup.id).first() is None:
+                rebuilt = TransactionService.rebuild_balance_rollups(db)
+                logger.info(f"Built balance rollups from {rebuilt} days of snapshots")
+            first = today if latest is None else min(latest + timedelta(days=1), today)
+            first = max(first, today - timedelta(days=self.backfill_days))
+
+            created = 0
+            day = first
+            while day <= today:
+                created += TransactionService.snapshot_all_balances(day, db)
+                day += timedelta(days=1)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        logger.info(f"Created {created} balance snapshots for {first} to {today}")
+        return created
+
+balance_snapshots = BalanceSnapshotScheduler(
+    enabled=BALANCE_SNAPSHOTS_ENABLED,
+    backfill_days=BALANCE_SNAPSHOT_BACKFILL_DAYS
+)
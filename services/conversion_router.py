@@ -0,0 +1,144 @@
+from sqlalchemy.orm import Session
+from models import TokenType
+from services.conversion_service import TOKENS, TOKEN_INDEX, cross_rates, conversion_stats, current_minute
+from dataclasses import dataclass
+from itertools import permutations
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+ARBITRAGE_EPSILON = 1e-9
+
+@dataclass
+class ConversionPath:
+    tokens: Tuple[TokenType, ...]
+    rate: float
+
+class ConversionRouter:
+    """Best conversion path between every pair of tokens, by -log(rate) weights.
+
+    The edge from_token -> to_token converts at the pair's rolling 24h
+    average trade rate when it has traded, else at the market rate. With
+    weights -log(rate), the best path is the one with the smallest total
+    weight and any cycle of negative weight is an arbitrage opportunity.
+
+    With only len(TokenType) tokens every simple path and cycle is
+    enumerated up front as an array of edge indices. When edge rates change
+    only the paths through the changed edges are re-summed and only the
+    pairs they connect re-pick their best path, so lookups are a dict read.
+    """
+
+    def __init__(self):
+        n = len(TOKENS)
+        self._lock = threading.Lock()
+        self._edge_count = n * n
+        # Padding points at an extra zero-weight edge
+        self._weights = np.full(self._edge_count + 1, np.inf)
+        self._weights[-1] = 0.0
+        self._inputs: Optional[Tuple[int, int, int]] = None
+
+        self._paths: List[Tuple[int, ...]] = []
+        self._path_pairs: List[Tuple[int, int]] = []
+        for start, end in permutations(range(n), 2):
+            others = [node for node in range(n) if node not in (start, end)]
+            for hops in range(len(others) + 1):
+                for middle in permutations(others, hops):
+                    self._paths.append((start, *middle, end))
+                    self._path_pairs.append((start, end))
+
+        self._cycles: List[Tuple[int, ...]] = []
+        for length in range(2, n + 1):
+            for nodes in permutations(range(n), length):
+                if nodes[0] == min(nodes):
+                    self._cycles.append(nodes + (nodes[0],))
+
+        self._path_edges = self._edge_matrix(self._paths)
+        self._cycle_edges = self._edge_matrix(self._cycles)
+        self._cycle_lengths = np.array([len(cycle) for cycle in self._cycles])
+        self._path_weights = np.full(len(self._paths), np.inf)
+        self._cycle_weights = np.full(len(self._cycles), np.inf)
+
+        self._pair_paths: Dict[Tuple[int, int], np.ndarray] = {}
+        for index, pair in enumerate(self._path_pairs):
+            self._pair_paths.setdefault(pair, []).append(index)
+        self._pair_paths = {pair: np.array(indices) for pair, indices in self._pair_paths.items()}
+
+        self._edge_paths = [np.flatnonzero((self._path_edges == edge).any(axis=1)) for edge in range(self._edge_count)]
+        self._edge_cycles = [np.flatnonzero((self._cycle_edges == edge).any(axis=1)) for edge in range(self._edge_count)]
+        self._best: Dict[Tuple[int, int], Optional[ConversionPath]] = {}
+        self._arbitrage: List[ConversionPath] = []
+
+    def _edge_matrix(self, walks: List[Tuple[int, ...]]) -> np.ndarray:
+        n = len(TOKENS)
+        width = max(len(walk) for walk in walks) - 1
+        edges = np.full((len(walks), width), self._edge_count)
+        for row, walk in enumerate(walks):
+            for column, (a, b) in enumerate(zip(walk, walk[1:])):
+                edges[row, column] = a * n + b
+        return edges
+
+    def _edge_rates(self, db: Session) -> np.ndarray:
+        market_rates = cross_rates.rates(db)
+        avg_rates = conversion_stats.avg_trade_rates(db)
+        return np.where(np.isnan(avg_rates), market_rates, avg_rates)
+
+    def _refresh(self, db: Session):
+        inputs = (cross_rates.version, conversion_stats.version, current_minute())
+        if inputs == self._inputs:
+            return
+
+        rates = self._edge_rates(db).ravel()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = np.where(rates > 0, -np.log(rates), np.inf)
+        np.fill_diagonal(weights.reshape(len(TOKENS), len(TOKENS)), 0.0)
+
+        changed = np.flatnonzero(weights != self._weights[:-1])
+        self._inputs = inputs
+        if not len(changed):
+            return
+        self._weights[:-1] = weights
+
+        paths = np.unique(np.concatenate([self._edge_paths[edge] for edge in changed]))
+        self._path_weights[paths] = self._weights[self._path_edges[paths]].sum(axis=1)
+        cycles = np.unique(np.concatenate([self._edge_cycles[edge] for edge in changed]))
+        self._cycle_weights[cycles] = self._weights[self._cycle_edges[cycles]].sum(axis=1)
+
+        for pair in {self._path_pairs[index] for index in paths}:
+            indices = self._pair_paths[pair]
+            weights = self._path_weights[indices]
+            # Paths are enumerated by hop count, so ties (e.g. consistent
+            # market rates) resolve to the most direct path
+            best = indices[np.argmax(weights <= weights.min() + ARBITRAGE_EPSILON)]
+            weight = self._path_weights[best]
+            self._best[pair] = (
+                ConversionPath(tuple(TOKENS[node] for node in self._paths[best]), float(np.exp(-weight)))
+                if np.isfinite(weight) else None
+            )
+
+        profitable = np.flatnonzero(self._cycle_weights < -ARBITRAGE_EPSILON)
+        self._arbitrage = [
+            ConversionPath(tuple(TOKENS[node] for node in self._cycles[index]), float(np.exp(-self._cycle_weights[index])))
+            for index in profitable[np.lexsort((
+                self._cycle_lengths[profitable], np.round(self._cycle_weights[profitable], 9)
+            ))]
+        ]
+        logger.debug(f"Updated conversion paths for {len(changed)} changed edges")
+
+    def best_path(self, from_token: TokenType, to_token: TokenType, db: Session) -> Optional[ConversionPath]:
+        """Highest-rate simple path from from_token to to_token (None if unreachable)"""
+        if from_token == to_token:
+            return ConversionPath((from_token,), 1.0)
+        with self._lock:
+            self._refresh(db)
+            return self._best.get((TOKEN_INDEX[from_token], TOKEN_INDEX[to_token]))
+
+    def arbitrage_cycles(self, db: Session) -> List[ConversionPath]:
+        """Cycles whose rates multiply to more than 1, most profitable first"""
+        with self._lock:
+            self._refresh(db)
+            return list(self._arbitrage)
+
+conversion_router = ConversionRouter()
@@ -1,10 +1,411 @@
+from sqlalchemy import event, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from models import MarketPrice, ConversionRate, TokenType
-from typing import Dict, Tuple
+from database import SessionLocal
+from models import MarketPrice, MarketPriceHistory, ConversionRate, ConversionVolumeBucket, TokenType
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+import asyncio
+import threading
 import logging
+import os
+import time
 
 logger = logging.getLogger(__name__)
 
+CONVERSION_STATS_FLUSH_SECONDS = float(os.getenv("CONVERSION_STATS_FLUSH_SECONDS", "5.0"))
+MARKET_PRICE_POLL_SECONDS = float(os.getenv("MARKET_PRICE_POLL_SECONDS", "1.0"))
+
+TOKENS = list(TokenType)
+TOKEN_INDEX = {token: index for index, token in enumerate(TOKENS)}
+
+class CrossRateCache:
+    """In-process matrix of market rates between every pair of tokens.
+
+    rates[i, j] is the price of TOKENS[i] in units of TOKENS[j], computed as
+    one outer division of the BTC prices. The matrix is built on first use
+    and rebuilt only after a transaction that changed market_prices commits
+    (see the listeners below); tokens without a price have NaN rates.
+
+    Prices ingested by another process (python -m services.price_feed ingest)
+    never reach those listeners, so a background task polls the latest
+    market_price_history id every poll_interval seconds and invalidates when
+    it moves past what this process wrote itself. Reads never query.
+    """
+
+    def __init__(self, poll_interval: float = 1.0):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._rates: Optional[np.ndarray] = None
+        self._stored_version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.version = 0
+        self._listeners: List[Callable[[], None]] = []
+
+    @staticmethod
+    def stored_version(db: Session) -> int:
+        """Latest market_price_history id, which every price ingestion advances"""
+        return db.query(func.max(MarketPriceHistory.id)).scalar() or 0
+
+    def subscribe(self, listener: Callable[[], None]):
+        """Call listener after every invalidation, i.e. after market prices change"""
+        self._listeners.append(listener)
+
+    def rates(self, db: Session) -> np.ndarray:
+        """Read-only cross-rate matrix, loading prices if needed"""
+        rates = self._rates
+        if rates is not None:
+            return rates
+
+        with self._lock:
+            if self._rates is None:
+                prices = np.full(len(TOKENS), np.nan)
+                for token_type, price_btc in db.query(MarketPrice.token_type, MarketPrice.price_btc):
+                    prices[TOKEN_INDEX[token_type]] = price_btc
+
+                rates = np.divide.outer(prices, prices)
+                np.fill_diagonal(rates, 1.0)
+                rates.flags.writeable = False
+                self._rates = rates
+                logger.info("Rebuilt cross-rate matrix from market prices")
+            return self._rates
+
+    def invalidate(self):
+        with self._lock:
+            self._rates = None
+            self.version += 1
+        for listener in self._listeners:
+            listener()
+
+    def note_stored_version(self, stored_version: int):
+        """Record price history written by this process, whose commit already invalidated the cache"""
+        with self._lock:
+            self._stored_version = stored_version
+
+    def poll(self, db: Session) -> bool:
+        """Invalidate if another process stored prices since the last poll, returning whether it did"""
+        stored_version = self.stored_version(db)
+        with self._lock:
+            previous, self._stored_version = self._stored_version, stored_version
+        if previous is None or stored_version == previous:
+            return False
+        logger.info("Market prices changed outside this process")
+        _market_prices_changed()
+        return True
+
+    def _poll_once(self):
+        db = SessionLocal()
+        try:
+            self.poll(db)
+        finally:
+            db.close()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._poll_once)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await loop.run_in_executor(None, self._poll_once)
+            except Exception:
+                logger.exception("Market price poll failed")
+
+cross_rates = CrossRateCache(poll_interval=MARKET_PRICE_POLL_SECONDS)
+
+Pair = Tuple[TokenType, TokenType]
+
+WINDOW_MINUTES = 24 * 60
+
+def current_minute() -> int:
+    return int(time.time() // 60)
+
+@dataclass
+class ConversionStats:
+    from_token: TokenType
+    to_token: TokenType
+    avg_trade_rate: Optional[float] = None
+    volume_24h: float = 0.0
+    spread_percentage: Optional[float] = None
+    last_updated: Optional[datetime] = None
+
+class VolumeWindow:
+    """Rolling per-minute buckets of traded volume for every token pair.
+
+    Each pair has a ring of `minutes` slots holding (volume, notional, trade
+    count) for the minute stamped on the slot. A trade in a newer minute that
+    maps to an occupied slot resets it, so adding a trade is O(1) and
+    reading a pair's window is one pass over its slots.
+    """
+
+    def __init__(self, minutes: int = WINDOW_MINUTES):
+        shape = (len(TOKENS), len(TOKENS), minutes)
+        self.minutes = minutes
+        self.volume = np.zeros(shape)
+        self.notional = np.zeros(shape)
+        self.trades = np.zeros(shape, dtype=np.int64)
+        self.stamps = np.full(shape, -1, dtype=np.int64)
+
+    def add(self, i: int, j: int, minute: int, volume: float, notional: float, trades: int = 1) -> Optional[int]:
+        """Add to the bucket of a minute, returning its slot (None if it fell out of the window)"""
+        slot = minute % self.minutes
+        stamp = self.stamps[i, j, slot]
+        if stamp > minute:
+            return None
+        if stamp < minute:
+            self.stamps[i, j, slot] = minute
+            self.volume[i, j, slot] = 0.0
+            self.notional[i, j, slot] = 0.0
+            self.trades[i, j, slot] = 0
+        self.volume[i, j, slot] += volume
+        self.notional[i, j, slot] += notional
+        self.trades[i, j, slot] += trades
+        return slot
+
+    def totals(self, minute: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Volume and notional over the window ending at minute, for every pair"""
+        live = self.stamps > minute - self.minutes
+        return np.where(live, self.volume, 0.0).sum(axis=2), np.where(live, self.notional, 0.0).sum(axis=2)
+
+    def pair_totals(self, i: int, j: int, minute: int) -> Tuple[float, float]:
+        live = self.stamps[i, j] > minute - self.minutes
+        return float(self.volume[i, j][live].sum()), float(self.notional[i, j][live].sum())
+
+    def bucket(self, i: int, j: int, slot: int) -> Tuple[int, float, float, int]:
+        return (
+            int(self.stamps[i, j, slot]),
+            float(self.volume[i, j, slot]),
+            float(self.notional[i, j, slot]),
+            int(self.trades[i, j, slot])
+        )
+
+def _window_stats(stats: ConversionStats, volume: float, notional: float) -> ConversionStats:
+    return replace(
+        stats,
+        volume_24h=volume,
+        avg_trade_rate=notional / volume if volume > 0 else None
+    )
+
+class ConversionStatsStore:
+    """Trade statistics per token pair, served from memory and written behind.
+
+    Volume and the volume-weighted average trade rate cover the last 24
+    hours, from a VolumeWindow of per-minute buckets; spread is that of the
+    latest trade. Everything is loaded on first use. Committed trades only
+    touch memory. A background task writes, every flush_interval seconds and
+    in one transaction, the buckets that changed and the conversion_rates
+    rows whose windowed values moved (including volume aging out), so any
+    number of trades between flushes costs one write per pair. Reads never
+    write.
+    """
+
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._stats: Optional[Dict[Pair, ConversionStats]] = None
+        self._window = VolumeWindow()
+        self._persisted: Dict[Pair, Tuple[float, Optional[float]]] = {}
+        self._dirty: Set[Pair] = set()
+        self._dirty_buckets: Set[Tuple[int, int, int]] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.version = 0
+
+    def _load(self, db: Session) -> Dict[Pair, ConversionStats]:
+        stats = self._stats
+        if stats is not None:
+            return stats
+
+        with self._lock:
+            if self._stats is None:
+                loaded = {}
+                for row in db.query(ConversionRate):
+                    pair = (row.from_token, row.to_token)
+                    loaded[pair] = ConversionStats(
+                        from_token=row.from_token,
+                        to_token=row.to_token,
+                        spread_percentage=row.spread_percentage,
+                        last_updated=row.last_updated
+                    )
+                    self._persisted[pair] = (row.volume_24h, row.avg_trade_rate)
+
+                buckets = db.query(ConversionVolumeBucket).filter(
+                    ConversionVolumeBucket.minute > current_minute() - self._window.minutes
+                )
+                for bucket in buckets:
+                    self._window.add(
+                        TOKEN_INDEX[bucket.from_token], TOKEN_INDEX[bucket.to_token],
+                        bucket.minute, bucket.volume, bucket.notional, bucket.trade_count
+                    )
+                self._stats = loaded
+            return self._stats
+
+    def get(self, from_token: TokenType, to_token: TokenType, db: Session) -> ConversionStats:
+        all_stats = self._load(db)
+        with self._lock:
+            stats = all_stats.get((from_token, to_token)) or ConversionStats(from_token, to_token)
+            volume, notional = self._window.pair_totals(
+                TOKEN_INDEX[from_token], TOKEN_INDEX[to_token], current_minute()
+            )
+            return _window_stats(stats, volume, notional)
+
+    def all(self, db: Session) -> List[ConversionStats]:
+        all_stats = self._load(db)
+        with self._lock:
+            volume, notional = self._window.totals(current_minute())
+            return [
+                _window_stats(stats, volume[TOKEN_INDEX[pair[0]], TOKEN_INDEX[pair[1]]],
+                              notional[TOKEN_INDEX[pair[0]], TOKEN_INDEX[pair[1]]])
+                for pair, stats in all_stats.items()
+            ]
+
+    def avg_trade_rates(self, db: Session) -> np.ndarray:
+        """Rolling 24h volume-weighted average trade rate of every pair (NaN without trades)"""
+        self._load(db)
+        with self._lock:
+            volume, notional = self._window.totals(current_minute())
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(volume > 0, notional / volume, np.nan)
+
+    def ensure_loaded(self, db: Session):
+        self._load(db)
+
+    def record_trades(self, trades: List[Tuple[TokenType, TokenType, float, float, float]]):
+        """Apply committed (from_token, to_token, trade_rate, amount, market_rate) trades"""
+        now = datetime.now(timezone.utc)
+        minute = current_minute()
+
+        with self._lock:
+            all_stats = self._stats
+            for from_token, to_token, trade_rate, trade_amount, market_rate in trades:
+                pair = (from_token, to_token)
+                i, j = TOKEN_INDEX[from_token], TOKEN_INDEX[to_token]
+                slot = self._window.add(i, j, minute, trade_amount, trade_amount * trade_rate)
+                if slot is not None:
+                    self._dirty_buckets.add((i, j, slot))
+
+                stats = all_stats.setdefault(pair, ConversionStats(from_token, to_token))
+                stats.spread_percentage = abs(trade_rate - market_rate) / market_rate * 100
+                stats.last_updated = now
+                self._dirty.add(pair)
+            self.version += 1
+
+    def mark_all_dirty(self):
+        """Persist every pair on the next flush, e.g. after market prices change"""
+        with self._lock:
+            if self._stats is not None:
+                self._dirty.update(self._stats)
+
+    def flush(self) -> int:
+        """Write changed buckets and conversion_rates rows, returning the rows written"""
+        if self._stats is None:
+            return 0
+
+        minute = current_minute()
+        with self._lock:
+            volume, notional = self._window.totals(minute)
+            pending = {}
+            for pair, stats in self._stats.items():
+                current = _window_stats(
+                    stats, volume[TOKEN_INDEX[pair[0]], TOKEN_INDEX[pair[1]]],
+                    notional[TOKEN_INDEX[pair[0]], TOKEN_INDEX[pair[1]]]
+                )
+                if pair in self._dirty or self._persisted.get(pair) != (current.volume_24h, current.avg_trade_rate):
+                    pending[pair] = current
+            dirty_buckets = self._dirty_buckets
+            buckets = [(TOKENS[i], TOKENS[j], *self._window.bucket(i, j, slot)) for i, j, slot in dirty_buckets]
+            dirty = self._dirty
+            self._dirty, self._dirty_buckets = set(), set()
+
+        if not pending and not buckets:
+            return 0
+
+        db = SessionLocal()
+        try:
+            rates = cross_rates.rates(db)
+            rows = {(row.from_token, row.to_token): row for row in db.query(ConversionRate)}
+
+            for pair, stats in pending.items():
+                market_rate = float(rates[TOKEN_INDEX[pair[0]], TOKEN_INDEX[pair[1]]])
+                row = rows.get(pair)
+                if row is None:
+                    if np.isnan(market_rate):
+                        continue
+                    row = ConversionRate(from_token=pair[0], to_token=pair[1])
+                    db.add(row)
+                if not np.isnan(market_rate):
+                    row.market_rate = market_rate
+                row.avg_trade_rate = stats.avg_trade_rate
+                row.volume_24h = stats.volume_24h
+                row.spread_percentage = stats.spread_percentage
+
+            if buckets:
+                stmt = sqlite_insert(ConversionVolumeBucket).values([
+                    {
+                        "from_token": from_token, "to_token": to_token, "minute": bucket_minute,
+                        "volume": bucket_volume, "notional": bucket_notional, "trade_count": trade_count
+                    }
+                    for from_token, to_token, bucket_minute, bucket_volume, bucket_notional, trade_count in buckets
+                ])
+                db.execute(stmt.on_conflict_do_update(
+                    index_elements=["from_token", "to_token", "minute"],
+                    set_={
+                        "volume": stmt.excluded.volume,
+                        "notional": stmt.excluded.notional,
+                        "trade_count": stmt.excluded.trade_count
+                    }
+                ))
+            db.query(ConversionVolumeBucket).filter(
+                ConversionVolumeBucket.minute <= minute - self._window.minutes
+            ).delete(synchronize_session=False)
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self._dirty.update(dirty)
+                self._dirty_buckets.update(dirty_buckets)
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            for pair, stats in pending.items():
+                self._persisted[pair] = (stats.volume_24h, stats.avg_trade_rate)
+
+        return len(pending)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception:
+                logger.exception("Conversion stats flush failed")
+
+conversion_stats = ConversionStatsStore(flush_interval=CONVERSION_STATS_FLUSH_SECONDS)
+
 class ConversionService:
     
     @staticmethod
@@ -12,17 +413,17 @@ class ConversionService:
         """Calculate market-based conversion rate between two tokens using BTC prices"""
         if from_token == to_token:
             return 1.0
-            
-        from_price = db.query(MarketPrice).filter(MarketPrice.token_type == from_token).first()
-        to_price = db.query(MarketPrice).filter(MarketPrice.token_type == to_token).first()
-        
-        if not from_price or not to_price:
+
+        market_rate = cross_rates.rates(db)[TOKEN_INDEX[from_token], TOKEN_INDEX[to_token]]
+        if np.isnan(market_rate):
             raise ValueError(f"Market prices not found for {from_token.value} or {to_token.value}")
         
-        market_rate = from_price.price_btc / to_price.price_btc
-        logger.info(f"Market rate {from_token.value} -> {to_token.value}: {market_rate}")
-        
-        return market_rate
+        return float(market_rate)
+
+    @staticmethod
+    def get_rate_matrix(db: Session) -> np.ndarray:
+        """Market rates between all tokens, indexed by position in TokenType"""
+        return cross_rates.rates(db)
     
     @staticmethod
     def validate_trade_rate(
@@ -39,34 +440,30 @@ class ConversionService:
         return is_valid, spread_percentage
     
     @staticmethod
-    def get_or_create_conversion_rate(
-        from_token: TokenType, 
-        to_token: TokenType, 
+    def quote(
+        requests: List[Tuple[TokenType, TokenType, float]],
         db: Session
-    ) -> ConversionRate:
-        """Get existing conversion rate or create new one with market calculation"""
-        conversion_rate = db.query(ConversionRate).filter(
-            ConversionRate.from_token == from_token,
-            ConversionRate.to_token == to_token
-        ).first()
-        
-        if not conversion_rate:
-            market_rate = ConversionService.calculate_market_rate(from_token, to_token, db)
-            conversion_rate = ConversionRate(
-                from_token=from_token,
-                to_token=to_token,
-                market_rate=market_rate,
-                volume_24h=0.0
-            )
-            db.add(conversion_rate)
-            db.commit()
-            db.refresh(conversion_rate)
-        else:
-            market_rate = ConversionService.calculate_market_rate(from_token, to_token, db)
-            conversion_rate.market_rate = market_rate
-            db.commit()
-        
-        return conversion_rate
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Market rate, average trade rate and estimated output for many (from, to, amount) at once.
+
+        Results are arrays aligned with requests; NaN where a rate is unknown.
+        """
+        from_index = np.array([TOKEN_INDEX[from_token] for from_token, _, _ in requests])
+        to_index = np.array([TOKEN_INDEX[to_token] for _, to_token, _ in requests])
+        amounts = np.array([amount for _, _, amount in requests], dtype=float)
+
+        market_rates = cross_rates.rates(db)[from_index, to_index]
+        avg_rates = conversion_stats.avg_trade_rates(db)[from_index, to_index]
+        return market_rates, avg_rates, amounts * market_rates
+
+    @staticmethod
+    def get_conversion_stats(from_token: TokenType, to_token: TokenType, db: Session) -> ConversionStats:
+        """Trade statistics for a pair, from memory"""
+        return conversion_stats.get(from_token, to_token, db)
+
+    @staticmethod
+    def list_conversion_stats(db: Session) -> List[ConversionStats]:
+        return conversion_stats.all(db)
     
     @staticmethod
     def update_conversion_rate_stats(
@@ -76,18 +473,46 @@ class ConversionService:
         trade_amount: float,
         db: Session
     ):
-        """Update conversion rate statistics after a trade"""
-        conversion_rate = ConversionService.get_or_create_conversion_rate(from_token, to_token, db)
-        
-        conversion_rate.volume_24h += trade_amount
-        
-        if conversion_rate.avg_trade_rate is None:
-            conversion_rate.avg_trade_rate = trade_rate
-        else:
-            conversion_rate.avg_trade_rate = (conversion_rate.avg_trade_rate + trade_rate) / 2
-        
-        market_rate = conversion_rate.market_rate
-        conversion_rate.spread_percentage = abs(trade_rate - market_rate) / market_rate * 100
-        
-        db.commit()
-        logger.info(f"Updated conversion rate stats for {from_token.value} -> {to_token.value}")
+        """Update conversion rate statistics after a trade, once db commits"""
+        market_rate = ConversionService.calculate_market_rate(from_token, to_token, db)
+        conversion_stats.ensure_loaded(db)
+        db.info.setdefault(_PENDING_TRADES_KEY, []).append(
+            (from_token, to_token, trade_rate, trade_amount, market_rate)
+        )
+
+_PRICES_CHANGED_KEY = "market_prices_changed"
+_PENDING_TRADES_KEY = "conversion_trades"
+
+@event.listens_for(SessionLocal, "after_flush")
+def _record_price_changes(session: Session, flush_context):
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(isinstance(obj, MarketPrice) for obj in changed):
+        session.info[_PRICES_CHANGED_KEY] = True
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _record_bulk_price_changes(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert) \
+            and orm_execute_state.bind_mapper is not None \
+            and orm_execute_state.bind_mapper.class_ is MarketPrice:
+        orm_execute_state.session.info[_PRICES_CHANGED_KEY] = True
+
+@event.listens_for(SessionLocal, "after_commit")
+def _invalidate_cross_rates(session: Session):
+    if session.info.pop(_PRICES_CHANGED_KEY, False):
+        _market_prices_changed()
+
+def _market_prices_changed():
+    cross_rates.invalidate()
+    conversion_stats.mark_all_dirty()
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_committed_trades(session: Session):
+    trades = session.info.pop(_PENDING_TRADES_KEY, None)
+    if trades:
+        conversion_stats.record_trades(trades)
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _discard_price_changes(session: Session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PRICES_CHANGED_KEY, None)
+        session.info.pop(_PENDING_TRADES_KEY, None)
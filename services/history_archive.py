@@ -0,0 +1,181 @@
+from sqlalchemy import String, create_engine, delete, func, insert, literal, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import TransactionHistory
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import glob
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR")
+HISTORY_ARCHIVE_AFTER_DAYS = int(os.getenv("HISTORY_ARCHIVE_AFTER_DAYS", "365"))
+
+@dataclass
+class ArchivePartition:
+    month: str
+    path: str
+    min_id: int
+    max_id: int
+
+class HistoryArchive:
+    """Cold storage for old transaction_history rows.
+
+    Rows older than after_days are moved into one SQLite file per calendar
+    month (transaction_history-YYYY-MM.db) holding the same table and
+    indexes, so paged reads seek into a partition just like the hot table.
+    Archiving only ever moves the oldest rows, so the hot table followed by
+    the partitions from newest to oldest is one continuous (created_at, id)
+    order, which is how TransactionService reads across them.
+    """
+
+    def __init__(self, directory: Optional[str], after_days: int = 365, batch_size: int = 10000):
+        self.directory = directory
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._engines: Dict[str, Engine] = {}
+        self._ranges: Dict[str, Tuple[float, Optional[Tuple[int, int]]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _path(self, month: str) -> str:
+        return os.path.join(self.directory, f"transaction_history-{month}.db")
+
+    def _engine(self, path: str) -> Engine:
+        with self._lock:
+            engine = self._engines.get(path)
+            if engine is None:
+                engine = self._engines[path] = create_engine(
+                    f"sqlite:///{path}", connect_args={"check_same_thread": False}
+                )
+            return engine
+
+    def session(self, partition: ArchivePartition) -> Session:
+        return Session(bind=self._engine(partition.path))
+
+    def partitions(self, newest_first: bool = False) -> List[ArchivePartition]:
+        if not self.enabled:
+            return []
+
+        partitions = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "transaction_history-*.db"))):
+            id_range = self._id_range(path)
+            if id_range is None:
+                continue
+            month = os.path.basename(path)[len("transaction_history-"):-len(".db")]
+            partitions.append(ArchivePartition(month, path, *id_range))
+
+        return partitions[::-1] if newest_first else partitions
+
+    def _id_range(self, path: str) -> Optional[Tuple[int, int]]:
+        mtime = os.path.getmtime(path)
+        cached = self._ranges.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with self._engine(path).connect() as conn:
+            low, high = conn.execute(
+                select(func.min(TransactionHistory.id), func.max(TransactionHistory.id))
+            ).one()
+        id_range = (low, high) if low is not None else None
+        self._ranges[path] = (mtime, id_range)
+        return id_range
+
+    def locate(self, transaction_id: int) -> Optional[ArchivePartition]:
+        """Partition whose id range covers transaction_id, if any"""
+        for partition in self.partitions():
+            if partition.min_id <= transaction_id <= partition.max_id:
+                return partition
+        return None
+
+    def archive(self, db: Session, now: Optional[datetime] = None) -> int:
+        """Move rows older than after_days into their month partitions, returning the rows moved.
+
+        Each batch is written (idempotently, by id) and committed to its
+        partitions before it is deleted from the hot table, so an interrupted
+        run is simply repeated.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        now = now or datetime.now(timezone.utc)
+        # Compared as text, as stored by SQLite's CURRENT_TIMESTAMP
+        cutoff = literal((now.date() - timedelta(days=self.after_days)).isoformat(), String)
+        table = TransactionHistory.__table__
+        moved = 0
+
+        while True:
+            rows = db.execute(
+                select(table).where(table.c.created_at < cutoff).order_by(table.c.id).limit(self.batch_size)
+            ).mappings().all()
+            if not rows:
+                break
+
+            by_month: Dict[str, List[dict]] = {}
+            for row in rows:
+                by_month.setdefault(row["created_at"].strftime("%Y-%m"), []).append(dict(row))
+
+            for month, month_rows in by_month.items():
+                engine = self._engine(self._path(month))
+                table.create(bind=engine, checkfirst=True)
+                with engine.begin() as conn:
+                    conn.execute(insert(table).prefix_with("OR REPLACE"), month_rows)
+
+            db.execute(delete(table).where(table.c.id.in_([row["id"] for row in rows])))
+            db.commit()
+            moved += len(rows)
+
+        if moved:
+            logger.info(f"Archived {moved} transaction history rows older than {self.after_days} days")
+        return moved
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.run_once)
+            except Exception:
+                logger.exception("Transaction history archival failed")
+
+            now = datetime.now(timezone.utc)
+            next_run = datetime.combine(now.date() + timedelta(days=1), time(hour=1), timezone.utc)
+            await asyncio.sleep((next_run - now).total_seconds())
+
+    def run_once(self) -> int:
+        db = SessionLocal()
+        try:
+            return self.archive(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+history_archive = HistoryArchive(HISTORY_ARCHIVE_DIR, after_days=HISTORY_ARCHIVE_AFTER_DAYS)
+
+if __name__ == "__main__":
+    import sys
+
+    if not history_archive.enabled:
+        sys.exit("HISTORY_ARCHIVE_DIR is not set")
+    print(f"Archived {history_archive.run_once()} rows")
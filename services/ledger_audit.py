@@ -0,0 +1,242 @@
+from sqlalchemy import case, select
+from sqlalchemy.orm import Session
+from models import Token, TransactionHistory, TokenType
+from services.history_archive import history_archive
+from dataclasses import dataclass, field
+from typing import Iterator, List, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKENS = list(TokenType)
+TOKEN_COUNT = len(TOKENS)
+
+def grouped_cumsum(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Running sums of values that restart wherever starts is True.
+
+    Each group start subtracts the previous group's total, so the running sum
+    stays within one group's magnitude instead of accumulating rounding error
+    across the whole array.
+    """
+    adjusted = values.astype(float)
+    start_index = np.flatnonzero(starts)
+    totals = np.add.reduceat(adjusted, start_index)
+    adjusted[start_index[1:]] -= totals[:-1]
+    return np.cumsum(adjusted)
+
+@dataclass
+class AuditReport:
+    rows: int = 0
+    balances: int = 0
+    amount_mismatches: int = 0
+    broken_chains: int = 0
+    drifted_rows: int = 0
+    balance_drifts: int = 0
+    untracked_balances: int = 0
+    opening_balances_allowed: bool = False
+    examples: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        untracked = self.untracked_balances and not self.opening_balances_allowed
+        return not (
+            self.amount_mismatches or self.broken_chains or self.drifted_rows or self.balance_drifts or untracked
+        )
+
+class LedgerAudit:
+    """Replays transaction_history per (user, token) and checks it against itself and tokens.
+
+    Ledger rows are read in id order (the order they were applied), from the
+    archive partitions and then the hot table, in fixed-size chunks. Each
+    chunk is checked with NumPy, grouping rows by (user, token) with a stable
+    sort:
+
+    - amount mismatch: balance_after - balance_before != amount
+    - broken chain: balance_before != the previous row's balance_after
+      (0 for the first row, so a non-zero opening balance breaks the chain)
+    - drift: balance_after != running sum of amounts from 0
+
+    Non-zero balances without ledger rows are untracked and also fail the
+    audit. allow_opening_balances accepts legacy data seeded without ledger
+    rows: the first row's balance_before then opens the replay and untracked
+    balances are reported but tolerated.
+
+    The running state per (user, token) lives in arrays indexed by
+    user_id * len(TokenType) + token, so memory grows with users, not rows.
+    Finally every tokens.balance is compared with its replayed balance.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 500000,
+        tolerance: float = 1e-6,
+        max_examples: int = 20,
+        allow_opening_balances: bool = False
+    ):
+        self.chunk_size = chunk_size
+        self.tolerance = tolerance
+        self.max_examples = max_examples
+        self.allow_opening_balances = allow_opening_balances
+        self._seen = np.zeros(0, dtype=bool)
+        self._last_after = np.zeros(0)
+        self._replayed = np.zeros(0)
+
+    def _ensure_capacity(self, max_key: int):
+        size = len(self._seen)
+        if max_key < size:
+            return
+        grow = max(max_key + 1, size * 2) - size
+        self._seen = np.concatenate([self._seen, np.zeros(grow, dtype=bool)])
+        self._last_after = np.concatenate([self._last_after, np.zeros(grow)])
+        self._replayed = np.concatenate([self._replayed, np.zeros(grow)])
+
+    def _mismatch(self, actual: np.ndarray, expected: np.ndarray) -> np.ndarray:
+        return ~np.isclose(actual, expected, rtol=1e-12, atol=self.tolerance)
+
+    def _example(self, report: AuditReport, message: str):
+        if len(report.examples) < self.max_examples:
+            report.examples.append(message)
+
+    @staticmethod
+    def _token_index(column):
+        # Map the enum to its position in SQL so chunks arrive as plain numbers
+        return case(*[(column == token, index) for index, token in enumerate(TOKENS)])
+
+    def _chunks(self, db: Session, columns, id_column) -> Iterator[Tuple[np.ndarray, ...]]:
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(id_column, *columns).where(id_column > last_id).order_by(id_column).limit(self.chunk_size)
+            ).all()
+            db.rollback()
+            if not rows:
+                return
+            yield tuple(np.array(column) for column in zip(*rows))
+            last_id = rows[-1][0]
+
+    def _ledger_chunks(self, db: Session) -> Iterator[Tuple[np.ndarray, ...]]:
+        columns = (
+            TransactionHistory.user_id,
+            self._token_index(TransactionHistory.token_type),
+            TransactionHistory.amount,
+            TransactionHistory.balance_before,
+            TransactionHistory.balance_after
+        )
+        for partition in history_archive.partitions():
+            archive_db = history_archive.session(partition)
+            try:
+                yield from self._chunks(archive_db, columns, TransactionHistory.id)
+            finally:
+                archive_db.close()
+        yield from self._chunks(db, columns, TransactionHistory.id)
+
+    def run(self, db: Session) -> AuditReport:
+        report = AuditReport(opening_balances_allowed=self.allow_opening_balances)
+
+        for ids, users, tokens, amounts, before, after in self._ledger_chunks(db):
+            self._check_chunk(report, ids, users * TOKEN_COUNT + tokens, amounts, before, after)
+            logger.info(f"Audited {report.rows} ledger rows")
+
+        token_columns = (Token.user_id, self._token_index(Token.token_type), Token.balance)
+        for ids, users, tokens, balances in self._chunks(db, token_columns, Token.id):
+            self._check_balances(report, users * TOKEN_COUNT + tokens, balances)
+
+        return report
+
+    def _check_chunk(self, report, ids, keys, amounts, before, after):
+        self._ensure_capacity(int(keys.max()))
+        report.rows += len(ids)
+
+        # Group rows by key; the stable sort keeps each group in id order
+        order = np.argsort(keys, kind="stable")
+        ids, keys, amounts, before, after = ids[order], keys[order], amounts[order], before[order], after[order]
+        starts = np.r_[True, keys[1:] != keys[:-1]]
+        ends = np.r_[keys[1:] != keys[:-1], True]
+        group = np.cumsum(starts) - 1
+        start_keys = keys[starts]
+        seen = self._seen[start_keys]
+        first_before = before[starts] if self.allow_opening_balances else 0.0
+
+        mismatched = self._mismatch(after - before, amounts)
+        report.amount_mismatches += int(mismatched.sum())
+        for row_id in ids[mismatched][:self.max_examples]:
+            self._example(report, f"Row {row_id}: balance change does not match amount")
+
+        previous_after = np.empty_like(after)
+        previous_after[1:] = after[:-1]
+        previous_after[starts] = np.where(seen, self._last_after[start_keys], first_before)
+        broken = self._mismatch(before, previous_after)
+        report.broken_chains += int(broken.sum())
+        for row_id in ids[broken][:self.max_examples]:
+            self._example(report, f"Row {row_id}: balance_before does not follow the previous balance_after")
+
+        opening = np.where(seen, self._replayed[start_keys], first_before)
+        replayed = opening[group] + grouped_cumsum(amounts, starts)
+
+        drifted = self._mismatch(after, replayed)
+        report.drifted_rows += int(drifted.sum())
+        first_drift = drifted & ~np.r_[False, drifted[:-1] & ~starts[1:]]
+        for row_id in ids[first_drift][:self.max_examples]:
+            self._example(report, f"Row {row_id}: balance_after drifts from the replayed balance")
+
+        end_keys = keys[ends]
+        self._seen[end_keys] = True
+        self._last_after[end_keys] = after[ends]
+        self._replayed[end_keys] = replayed[ends]
+
+    def _check_balances(self, report, keys, balances):
+        report.balances += len(keys)
+        self._ensure_capacity(int(keys.max()))
+
+        tracked = self._seen[keys]
+        untracked = ~tracked & self._mismatch(balances, np.zeros_like(balances))
+        report.untracked_balances += int(untracked.sum())
+        if not self.allow_opening_balances:
+            for key, balance in zip(keys[untracked][:self.max_examples], balances[untracked]):
+                user_id, token = divmod(int(key), TOKEN_COUNT)
+                self._example(report, f"User {user_id} {TOKENS[token].value}: balance {balance} has no ledger rows")
+
+        drifted = tracked & self._mismatch(balances, self._replayed[keys])
+        report.balance_drifts += int(drifted.sum())
+        for key, balance in zip(keys[drifted][:self.max_examples], balances[drifted]):
+            user_id, token = divmod(int(key), TOKEN_COUNT)
+            self._example(
+                report,
+                f"User {user_id} {TOKENS[token].value}: balance {balance} but ledger replays to {self._replayed[key]}"
+            )
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import time
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Audit token balances against the transaction ledger")
+    parser.add_argument("--chunk-size", type=int, default=500000)
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    parser.add_argument("--max-examples", type=int, default=20)
+    parser.add_argument(
+        "--allow-opening-balances", action="store_true",
+        help="Accept legacy balances seeded without ledger rows (first balance_before opens the replay)"
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        report = LedgerAudit(
+            args.chunk_size, args.tolerance, args.max_examples, args.allow_opening_balances
+        ).run(db)
+    finally:
+        db.close()
+
+    for example in report.examples:
+        print(example)
+    print(
+        f"{report.rows} ledger rows, {report.balances} balances in {time.perf_counter() - started:.1f}s: "
+        f"{report.amount_mismatches} amount mismatches, {report.broken_chains} broken chains, "
+        f"{report.drifted_rows} drifted rows, {report.balance_drifts} balance drifts, "
+        f"{report.untracked_balances} non-zero balances without ledger rows"
+    )
+    sys.exit(0 if report.ok else 1)
@@ -0,0 +1,193 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Order, Token, TradeStatus, TokenType
+from services.order_matching_service import OrderMatchingService
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CONTINUOUS = "continuous"
+AUCTION = "auction"
+
+MATCHING_MODE = os.getenv("MATCHING_MODE", CONTINUOUS)
+AUCTION_INTERVAL_SECONDS = float(os.getenv("AUCTION_INTERVAL_SECONDS", "1.0"))
+
+@dataclass
+class EngineCommand:
+    action: str
+    order_id: int
+    future: Future = field(default_factory=Future)
+
+class MatchingEngine:
+    """Single-writer matching engine.
+
+    Orders are queued per market (the unordered token pair, so both sides of a
+    book share one sequencer). Each sequencer drains its queue in arrival order
+    and hands batches to one writer thread, which matches and commits a whole
+    batch at once. Callers get a Future resolved after the batch is committed.
+
+    In auction mode a sequencer instead collects orders for auction_interval
+    seconds and then clears its market in one batch auction.
+    """
+
+    def __init__(self, batch_size: int = 100, mode: str = CONTINUOUS, auction_interval: float = 1.0):
+        if mode not in (CONTINUOUS, AUCTION):
+            raise ValueError(f"Unknown matching mode: {mode}")
+        self.batch_size = batch_size
+        self.mode = mode
+        self.auction_interval = auction_interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queues: Dict[FrozenSet[TokenType], asyncio.Queue] = {}
+        self._tasks: Dict[FrozenSet[TokenType], asyncio.Task] = {}
+
+    @property
+    def is_running(self) -> bool:
+        return self._loop is not None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="matching-engine")
+        logger.info("Matching engine started")
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+        self._queues.clear()
+        self._executor.shutdown(wait=True)
+        self._loop = None
+        logger.info("Matching engine stopped")
+
+    def submit(self, order: Order) -> Future:
+        """Queue a committed PENDING order for matching (thread-safe)"""
+        return self._submit("match", order)
+
+    def cancel(self, order: Order) -> Future:
+        """Queue cancellation of an order behind any matching already queued"""
+        return self._submit("cancel", order)
+
+    def _submit(self, action: str, order: Order) -> Future:
+        if not self.is_running:
+            raise RuntimeError("Matching engine is not running")
+        command = EngineCommand(action=action, order_id=order.id)
+        market = frozenset((order.from_token, order.to_token))
+        self._loop.call_soon_threadsafe(self._enqueue, market, command)
+        return command.future
+
+    def _enqueue(self, market: FrozenSet[TokenType], command: EngineCommand):
+        queue = self._queues.get(market)
+        if queue is None:
+            queue = self._queues[market] = asyncio.Queue()
+            self._tasks[market] = self._loop.create_task(self._sequence(market, queue))
+        queue.put_nowait(command)
+
+    async def _sequence(self, market: FrozenSet[TokenType], queue: asyncio.Queue):
+        while True:
+            if self.mode == AUCTION:
+                await asyncio.sleep(self.auction_interval)
+                if queue.empty():
+                    continue
+                batch = []
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+            else:
+                batch = [await queue.get()]
+                while len(batch) < self.batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+
+            try:
+                results = await self._loop.run_in_executor(self._executor, self._process_batch, market, batch)
+            except Exception as e:
+                logger.exception("Matching engine batch failed")
+                for command in batch:
+                    command.future.set_exception(e)
+                continue
+
+            for command, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    command.future.set_exception(result)
+                else:
+                    command.future.set_result(result)
+
+    def _process_batch(self, market: FrozenSet[TokenType], batch: List[EngineCommand]) -> list:
+        """Run a batch in one transaction, replaying it without any command that fails"""
+        failed: Dict[int, Exception] = {}
+        while True:
+            db = SessionLocal()
+            try:
+                results = self._run_batch(market, batch, failed, db)
+                if results is not None:
+                    db.commit()
+                    return results
+                db.rollback()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+    def _run_batch(
+        self,
+        market: FrozenSet[TokenType],
+        batch: List[EngineCommand],
+        failed: Dict[int, Exception],
+        db: Session
+    ) -> Optional[list]:
+        results = []
+        for index, command in enumerate(batch):
+            if index in failed:
+                results.append(failed[index])
+                continue
+            try:
+                results.append(self._process_command(command, db))
+            except ValueError as e:
+                logger.warning(f"Order {command.order_id} failed to settle, replaying batch without it: {e}")
+                failed[index] = e
+                return None
+
+        if self.mode == AUCTION:
+            base_token, quote_token = sorted(market, key=lambda token: token.value)
+            trades = OrderMatchingService.run_batch_auction(base_token, quote_token, db)
+            results = [
+                [trades[command.order_id].id] if command.order_id in trades else result
+                for command, result in zip(batch, results)
+            ]
+
+        return results
+
+    def _process_command(self, command: EngineCommand, db: Session):
+        order = db.get(Order, command.order_id)
+        if order is None or order.status != TradeStatus.PENDING:
+            return LookupError(f"Order {command.order_id} is no longer pending")
+
+        if command.action == "cancel":
+            order.status = TradeStatus.CANCELLED
+            db.flush()
+            return []
+
+        user_token = db.query(Token).filter(
+            Token.user_id == order.user_id,
+            Token.token_type == order.from_token
+        ).first()
+
+        remaining = OrderMatchingService.remaining_amount(order)
+        if not user_token or user_token.balance < remaining:
+            order.status = TradeStatus.CANCELLED
+            db.flush()
+            return ValueError("Insufficient balance for order")
+
+        if self.mode == AUCTION:
+            return []
+
+        trades = OrderMatchingService.process_order(order, db)
+        db.flush()
+        return [trade.id for trade in trades]
+
+matching_engine = MatchingEngine(mode=MATCHING_MODE, auction_interval=AUCTION_INTERVAL_SECONDS)
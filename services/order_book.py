@@ -0,0 +1,291 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Order, TradeStatus, TokenType
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from bisect import bisect_left, insort
+from itertools import permutations
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+Pair = Tuple[TokenType, TokenType]
+
+ORDER_NEW = "new"
+ORDER_FILL = "fill"
+ORDER_CANCEL = "cancel"
+
+@dataclass
+class BookEntry:
+    order_id: int
+    user_id: int
+    from_token: TokenType
+    to_token: TokenType
+    amount: float
+    exchange_rate: float
+
+    @property
+    def key(self) -> Tuple[float, int]:
+        return (self.exchange_rate, self.order_id)
+
+    @property
+    def pair(self) -> Pair:
+        return (self.from_token, self.to_token)
+
+@dataclass
+class OrderChange:
+    entry: BookEntry
+    resting: bool
+    event: str
+
+class OrderBook:
+    """Resting PENDING orders for one (from_token, to_token) pair.
+
+    Orders are kept sorted by (exchange_rate, order_id): the lowest rate is the
+    best offer for a counterparty, and ids break ties in arrival order. Total
+    amount and order count per rate level are maintained alongside, so depth
+    reads only touch the levels they return.
+    """
+
+    def __init__(self, pair: Pair):
+        self.pair = pair
+        self._keys: List[Tuple[float, int]] = []
+        self._entries: Dict[int, BookEntry] = {}
+        self._level_rates: List[float] = []
+        self._levels: Dict[float, List[float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._entries
+
+    def get(self, order_id: int) -> Optional[BookEntry]:
+        return self._entries.get(order_id)
+
+    def add(self, entry: BookEntry):
+        existing = self._entries.get(entry.order_id)
+        if existing is not None:
+            if existing.exchange_rate == entry.exchange_rate:
+                self._levels[existing.exchange_rate][0] += entry.amount - existing.amount
+                existing.amount = entry.amount
+                return
+            self.remove(entry.order_id)
+        self._entries[entry.order_id] = entry
+        insort(self._keys, entry.key)
+        self._update_level(entry.exchange_rate, entry.amount, 1)
+
+    def remove(self, order_id: int) -> Optional[BookEntry]:
+        entry = self._entries.pop(order_id, None)
+        if entry is None:
+            return None
+        index = bisect_left(self._keys, entry.key)
+        if index < len(self._keys) and self._keys[index] == entry.key:
+            del self._keys[index]
+        self._update_level(entry.exchange_rate, -entry.amount, -1)
+        return entry
+
+    def _update_level(self, rate: float, amount: float, count: int):
+        level = self._levels.get(rate)
+        if level is None:
+            level = self._levels[rate] = [0.0, 0]
+            insort(self._level_rates, rate)
+        level[0] += amount
+        level[1] += count
+        if level[1] <= 0:
+            del self._levels[rate]
+            del self._level_rates[bisect_left(self._level_rates, rate)]
+
+    def best(self) -> Optional[BookEntry]:
+        if not self._keys:
+            return None
+        return self._entries[self._keys[0][1]]
+
+    def iter_range(self, min_rate: float, max_rate: float) -> Iterator[BookEntry]:
+        """Yield entries with min_rate <= exchange_rate <= max_rate in priority order"""
+        index = bisect_left(self._keys, (min_rate, -1))
+        while index < len(self._keys):
+            rate, order_id = self._keys[index]
+            if rate > max_rate:
+                break
+            yield self._entries[order_id]
+            index += 1
+
+    def depth(self, levels: int) -> List[Tuple[float, float, int]]:
+        """Best price levels as (exchange_rate, total amount, order count)"""
+        return [
+            (rate, self._levels[rate][0], self._levels[rate][1])
+            for rate in self._level_rates[:levels]
+        ]
+
+class OrderBookRegistry:
+    """Process-wide set of order books, lazily loaded from the orders table.
+
+    Books are updated from session flushes (see the listeners below), so every
+    code path that writes an Order keeps them in sync. A transaction that ends
+    without committing marks the pairs it touched as stale, and they are
+    reloaded on next access.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._books: Dict[Pair, OrderBook] = {}
+        self._stale: Set[Pair] = set()
+        self._order_pairs: Dict[int, Pair] = {}
+        self._listeners: List[Callable[[OrderBook], None]] = []
+        self._commit_listeners: List[Callable[[List[OrderChange]], None]] = []
+
+    def subscribe(self, listener: Callable[[OrderBook], None]):
+        """Call listener with a book (under the registry lock) whenever it changes"""
+        self._listeners.append(listener)
+
+    def subscribe_commits(self, listener: Callable[[List[OrderChange]], None]):
+        """Call listener with the order changes of every committed transaction"""
+        self._commit_listeners.append(listener)
+
+    def _notify(self, book: OrderBook):
+        for listener in self._listeners:
+            listener(book)
+
+    def book(self, from_token: TokenType, to_token: TokenType, db: Session) -> OrderBook:
+        pair = (from_token, to_token)
+        with self.lock:
+            book = self._books.get(pair)
+            if book is None or pair in self._stale:
+                book = self._load(pair, db)
+            return book
+
+    def loaded_book(self, from_token: TokenType, to_token: TokenType) -> Optional[OrderBook]:
+        """The book if it is loaded and current, without touching the database"""
+        pair = (from_token, to_token)
+        with self.lock:
+            return None if pair in self._stale else self._books.get(pair)
+
+    def _load(self, pair: Pair, db: Session) -> OrderBook:
+        previous = self._books.get(pair)
+        if previous is not None:
+            for order_id in list(previous._entries):
+                self._order_pairs.pop(order_id, None)
+
+        book = OrderBook(pair)
+        rows = db.query(
+            Order.id, Order.user_id, Order.amount - Order.filled_amount, Order.exchange_rate
+        ).filter(
+            Order.status == TradeStatus.PENDING,
+            Order.from_token == pair[0],
+            Order.to_token == pair[1]
+        ).all()
+
+        for order_id, user_id, amount, exchange_rate in rows:
+            book.add(BookEntry(order_id, user_id, pair[0], pair[1], amount, exchange_rate))
+            self._order_pairs[order_id] = pair
+
+        self._books[pair] = book
+        self._stale.discard(pair)
+        self._notify(book)
+        logger.info(f"Loaded order book {pair[0].value} -> {pair[1].value}: {len(book)} orders")
+        return book
+
+    def apply(self, entry: BookEntry, resting: bool):
+        """Insert, update or remove an order so the book mirrors its row"""
+        with self.lock:
+            previous_pair = self._order_pairs.get(entry.order_id)
+            if previous_pair is not None and previous_pair != entry.pair:
+                self._books[previous_pair].remove(entry.order_id)
+                del self._order_pairs[entry.order_id]
+                self._notify(self._books[previous_pair])
+
+            book = self._books.get(entry.pair)
+            if book is None:
+                return
+
+            if resting:
+                book.add(entry)
+                self._order_pairs[entry.order_id] = entry.pair
+            else:
+                book.remove(entry.order_id)
+                self._order_pairs.pop(entry.order_id, None)
+            self._notify(book)
+
+    def confirm(self, changes: List[OrderChange]):
+        with self.lock:
+            for change in changes:
+                self.apply(change.entry, change.resting)
+            for listener in self._commit_listeners:
+                listener(changes)
+
+    def invalidate(self, pairs: Set[Pair]):
+        with self.lock:
+            self._stale.update(pair for pair in pairs if pair in self._books)
+
+    def restore(self, entries: Iterable[BookEntry]):
+        """Replace every book with the given resting orders (e.g. from recovery)"""
+        with self.lock:
+            self._books = {pair: OrderBook(pair) for pair in permutations(TokenType, 2)}
+            self._stale.clear()
+            self._order_pairs.clear()
+
+            for entry in entries:
+                self._books[entry.pair].add(entry)
+                self._order_pairs[entry.order_id] = entry.pair
+
+            for book in self._books.values():
+                self._notify(book)
+
+order_books = OrderBookRegistry()
+
+_PENDING_KEY = "order_book_entries"
+
+def _snapshot(order: Order, deleted: bool = False) -> OrderChange:
+    entry = BookEntry(
+        order_id=order.id,
+        user_id=order.user_id,
+        from_token=order.from_token,
+        to_token=order.to_token,
+        amount=order.amount - (order.filled_amount or 0.0),
+        exchange_rate=order.exchange_rate
+    )
+    resting = not deleted and order.status == TradeStatus.PENDING and entry.amount > 0
+
+    if deleted or order.status == TradeStatus.CANCELLED:
+        order_event = ORDER_CANCEL
+    elif order.filled_amount or order.status != TradeStatus.PENDING:
+        order_event = ORDER_FILL
+    else:
+        order_event = ORDER_NEW
+
+    return OrderChange(entry, resting, order_event)
+
+@event.listens_for(SessionLocal, "after_flush")
+def _record_order_changes(session: Session, flush_context):
+    changes = session.info.setdefault(_PENDING_KEY, {})
+
+    for obj in session.new.union(session.dirty):
+        if isinstance(obj, Order):
+            change = _snapshot(obj)
+            changes[change.entry.order_id] = change
+            order_books.apply(change.entry, change.resting)
+
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            change = _snapshot(obj, deleted=True)
+            changes[change.entry.order_id] = change
+            order_books.apply(change.entry, change.resting)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _confirm_order_changes(session: Session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes:
+        return
+    order_books.confirm(list(changes.values()))
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def _discard_order_changes(session: Session, transaction):
+    if transaction.parent is not None:
+        return
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes:
+        return
+    order_books.invalidate({change.entry.pair for change in changes.values()})
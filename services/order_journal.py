@@ -0,0 +1,316 @@
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Order, TradeStatus, TokenType
+from services.order_book import (
+    BookEntry, OrderChange, order_books, ORDER_NEW, ORDER_FILL, ORDER_CANCEL
+)
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import glob
+import os
+import struct
+import threading
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+ORDER_JOURNAL_DIR = os.getenv("ORDER_JOURNAL_DIR")
+ORDER_SNAPSHOT_INTERVAL = int(os.getenv("ORDER_SNAPSHOT_INTERVAL", "100000"))
+ORDER_JOURNAL_FSYNC = os.getenv("ORDER_JOURNAL_FSYNC", "true").lower() == "true"
+
+TOKENS = list(TokenType)
+EVENT_CODES = {ORDER_NEW: 1, ORDER_FILL: 2, ORDER_CANCEL: 3}
+EVENT_NAMES = {code: name for name, code in EVENT_CODES.items()}
+
+# seq, event, order_id, user_id, from_token, to_token, remaining amount, exchange_rate
+RECORD = struct.Struct("<QBQQBBdd")
+CHECKSUM = struct.Struct("<I")
+# order_id, user_id, from_token, to_token, remaining amount, exchange_rate
+SNAPSHOT_ENTRY = struct.Struct("<QQBBdd")
+# magic, seq, entry count, highest order id journaled
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")
+SNAPSHOT_MAGIC = b"OBSNAP02"
+# Snapshots written before the order id watermark; recovery reconciles them in full
+LEGACY_SNAPSHOT_HEADER = struct.Struct("<8sQQ")
+LEGACY_SNAPSHOT_MAGIC = b"OBSNAP01"
+
+class OrderJournal:
+    """Append-only journal of committed order events with periodic snapshots.
+
+    Every committed order change is appended as a fixed-size, checksummed
+    record. The journal mirrors the committed resting orders so a snapshot can
+    be written at any time without including in-flight transactions. Each
+    snapshot starts a new journal segment and older segments are deleted.
+    Recovery loads the latest snapshot and replays the segments after it; a
+    torn record at the end of the last segment (a crash mid-write) is ignored.
+    The snapshot also keeps the highest order id journaled, which together
+    with the number of resting orders is checked against the orders table.
+    """
+
+    def __init__(self, directory: Optional[str], snapshot_interval: int = 100000, fsync: bool = True):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._state: Dict[int, BookEntry] = {}
+        self._seq = 0
+        self._max_order_id = 0
+        self._since_snapshot = 0
+        self._segment: Optional[BinaryIO] = None
+
+        if self.enabled:
+            order_books.subscribe_commits(self.record)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.directory, "orders.snapshot")
+
+    def _segment_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "orders-*.journal")))
+
+    def _segment_path(self, first_seq: int) -> str:
+        return os.path.join(self.directory, f"orders-{first_seq:020d}.journal")
+
+    def replay(self) -> Tuple[Dict[int, BookEntry], int, int]:
+        """Rebuild committed resting orders from the snapshot and journal tail.
+
+        Returns the resting orders, the last seq and the highest order id journaled.
+        """
+        state, seq, max_order_id = self._read_snapshot()
+        snapshot_seq = seq
+
+        for path in self._segment_paths():
+            for record_seq, order_event, entry in self._read_segment(path):
+                if record_seq <= snapshot_seq:
+                    continue
+                seq = record_seq
+                max_order_id = max(max_order_id, entry.order_id)
+                if order_event != ORDER_CANCEL and entry.amount > 0:
+                    state[entry.order_id] = entry
+                else:
+                    state.pop(entry.order_id, None)
+
+        return state, seq, max_order_id
+
+    def recover(self, db: Session):
+        """Restore the order books from disk, reconciled with the orders table, and start journaling.
+
+        Records are appended after the database commit, and rows written
+        outside the ORM session are never journaled, so the replay is checked
+        against a cheap watermark of the orders table: the highest order id
+        and the number of PENDING orders (both index lookups). On a mismatch
+        the books are rebuilt from a full scan of the PENDING orders and a
+        fresh snapshot is written. verify() does the full comparison.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        max_order_id = db.query(func.max(Order.id)).scalar() or 0
+        pending = db.query(func.count(Order.id)).filter(Order.status == TradeStatus.PENDING).scalar()
+
+        if os.path.exists(self._snapshot_path()) or self._segment_paths():
+            state, seq, journaled_max_order_id = self.replay()
+            if journaled_max_order_id == max_order_id and len(state) == pending:
+                logger.info(f"Recovered {len(state)} resting orders from order journal at seq {seq}")
+            else:
+                logger.warning(
+                    f"Order journal (last order {journaled_max_order_id}, {len(state)} resting) disagrees "
+                    f"with the orders table (last order {max_order_id}, {pending} pending); "
+                    f"rebuilding the order books from the database"
+                )
+                state = self._load_from_database(db)
+        else:
+            state, seq = self._load_from_database(db), 0
+            logger.info(f"Initialized order journal from {len(state)} resting orders")
+
+        with order_books.lock, self._lock:
+            self._state = state
+            self._seq = seq
+            self._max_order_id = max_order_id
+            order_books.restore(list(state.values()))
+            self._write_snapshot()
+
+    def record(self, changes: List[OrderChange]):
+        """Append the changes of one committed transaction"""
+        with self._lock:
+            if self._segment is None:
+                return
+
+            data = bytearray()
+            for change in changes:
+                self._seq += 1
+                entry = change.entry
+                amount = entry.amount if change.resting else 0.0
+                packed = RECORD.pack(
+                    self._seq,
+                    EVENT_CODES[change.event],
+                    entry.order_id,
+                    entry.user_id,
+                    TOKENS.index(entry.from_token),
+                    TOKENS.index(entry.to_token),
+                    amount,
+                    entry.exchange_rate
+                )
+                data += packed + CHECKSUM.pack(zlib.crc32(packed))
+                self._max_order_id = max(self._max_order_id, entry.order_id)
+
+                if change.resting:
+                    self._state[entry.order_id] = BookEntry(
+                        entry.order_id, entry.user_id, entry.from_token,
+                        entry.to_token, entry.amount, entry.exchange_rate
+                    )
+                else:
+                    self._state.pop(entry.order_id, None)
+
+            self._segment.write(data)
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+
+            self._since_snapshot += len(changes)
+            if self._since_snapshot >= self.snapshot_interval:
+                self._write_snapshot()
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._write_snapshot()
+                self._segment.close()
+                self._segment = None
+
+    def _write_snapshot(self):
+        """Write the mirrored state atomically and rotate to a fresh segment"""
+        path = self._snapshot_path()
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self._seq, len(self._state), self._max_order_id))
+            for entry in self._state.values():
+                f.write(SNAPSHOT_ENTRY.pack(
+                    entry.order_id,
+                    entry.user_id,
+                    TOKENS.index(entry.from_token),
+                    TOKENS.index(entry.to_token),
+                    entry.amount,
+                    entry.exchange_rate
+                ))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        if self._segment is not None:
+            self._segment.close()
+        for old_path in self._segment_paths():
+            os.remove(old_path)
+        self._segment = open(self._segment_path(self._seq + 1), "ab")
+        self._since_snapshot = 0
+
+        logger.info(f"Wrote order book snapshot at seq {self._seq}: {len(self._state)} resting orders")
+
+    def _read_snapshot(self) -> Tuple[Dict[int, BookEntry], int, int]:
+        path = self._snapshot_path()
+        if not os.path.exists(path):
+            return {}, 0, 0
+
+        with open(path, "rb") as f:
+            magic = f.read(len(SNAPSHOT_MAGIC))
+            f.seek(0)
+            if magic == SNAPSHOT_MAGIC:
+                _, seq, count, max_order_id = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            elif magic == LEGACY_SNAPSHOT_MAGIC:
+                _, seq, count = LEGACY_SNAPSHOT_HEADER.unpack(f.read(LEGACY_SNAPSHOT_HEADER.size))
+                max_order_id = 0
+            else:
+                raise ValueError(f"Not an order book snapshot: {path}")
+
+            state = {}
+            data = f.read(SNAPSHOT_ENTRY.size * count)
+            for order_id, user_id, from_index, to_index, amount, rate in SNAPSHOT_ENTRY.iter_unpack(data):
+                state[order_id] = BookEntry(order_id, user_id, TOKENS[from_index], TOKENS[to_index], amount, rate)
+
+        return state, seq, max_order_id
+
+    def _read_segment(self, path: str) -> Iterator[Tuple[int, str, BookEntry]]:
+        record_size = RECORD.size + CHECKSUM.size
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(record_size)
+                if len(data) < record_size:
+                    if data:
+                        logger.warning(f"Ignoring torn record at end of {path}")
+                    return
+
+                packed = data[:RECORD.size]
+                (checksum,) = CHECKSUM.unpack(data[RECORD.size:])
+                if zlib.crc32(packed) != checksum:
+                    logger.warning(f"Stopping replay of {path} at corrupt record")
+                    return
+
+                seq, code, order_id, user_id, from_index, to_index, amount, rate = RECORD.unpack(packed)
+                entry = BookEntry(order_id, user_id, TOKENS[from_index], TOKENS[to_index], amount, rate)
+                yield seq, EVENT_NAMES[code], entry
+
+    @staticmethod
+    def _load_from_database(db: Session) -> Dict[int, BookEntry]:
+        rows = db.query(
+            Order.id, Order.user_id, Order.from_token, Order.to_token,
+            Order.amount - Order.filled_amount, Order.exchange_rate
+        ).filter(Order.status == TradeStatus.PENDING).all()
+
+        return {
+            row[0]: BookEntry(*row)
+            for row in rows
+            if row[4] > 0
+        }
+
+    def verify(self, db: Session) -> List[str]:
+        """Compare the replayed journal with the orders table, returning mismatches"""
+        replayed, _, _ = self.replay()
+        return self._compare(replayed, self._load_from_database(db))
+
+    @staticmethod
+    def _compare(replayed: Dict[int, BookEntry], expected: Dict[int, BookEntry]) -> List[str]:
+        problems = []
+
+        for order_id in sorted(expected.keys() - replayed.keys()):
+            problems.append(f"Order {order_id} is pending in the database but missing from the journal")
+        for order_id in sorted(replayed.keys() - expected.keys()):
+            problems.append(f"Order {order_id} is resting in the journal but not pending in the database")
+        for order_id in sorted(expected.keys() & replayed.keys()):
+            db_entry, journal_entry = expected[order_id], replayed[order_id]
+            if (
+                abs(db_entry.amount - journal_entry.amount) > 1e-9
+                or db_entry.exchange_rate != journal_entry.exchange_rate
+                or db_entry.pair != journal_entry.pair
+            ):
+                problems.append(
+                    f"Order {order_id} differs: database {db_entry.amount} @ {db_entry.exchange_rate}, "
+                    f"journal {journal_entry.amount} @ {journal_entry.exchange_rate}"
+                )
+
+        return problems
+
+order_journal = OrderJournal(
+    ORDER_JOURNAL_DIR,
+    snapshot_interval=ORDER_SNAPSHOT_INTERVAL,
+    fsync=ORDER_JOURNAL_FSYNC
+)
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocal
+
+    if not order_journal.enabled:
+        sys.exit("ORDER_JOURNAL_DIR is not set")
+
+    db = SessionLocal()
+    try:
+        problems = order_journal.verify(db)
+    finally:
+        db.close()
+
+    for problem in problems:
+        print(problem)
+    print(f"{len(problems)} mismatches found" if problems else "Order journal matches the orders table")
+    sys.exit(1 if problems else 0)
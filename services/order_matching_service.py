@@ -1,130 +1,373 @@
 from sqlalchemy.orm import Session
-from models import Order, Trade, TradeStatus, TokenType, TransactionType
-from services.transaction_service import TransactionService
+from models import Order, Trade, Token, TradeStatus, TokenType, TransactionType
+from services.transaction_service import TransactionService, BalanceLeg
+from services.order_book import order_books
+from services.order_router import order_router
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List, Set, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+FILL_EPSILON = 1e-9
 
 class OrderMatchingService:
     
     @staticmethod
-    def find_matching_order(order: Order, db: Session) -> Optional[Order]:
-        matching_orders = db.query(Order).filter(
-            Order.status == TradeStatus.PENDING,
-            Order.from_token == order.to_token,
-            Order.to_token == order.from_token,
-            Order.user_id != order.user_id
-        ).all()
-        
-        for matching_order in matching_orders:
-            if OrderMatchingService.are_rates_compatible(order, matching_order):
-                return matching_order
-        
-        return None
+    def remaining_amount(order: Order) -> float:
+        return order.amount - (order.filled_amount or 0.0)
+    
+    @staticmethod
+    def calculate_fill(order1: Order, order2: Order) -> Tuple[float, float]:
+        """Size a fill of order1 against resting order2 at order2's rate.
+        
+        Returns (trade_amount, required_amount): order1 sends trade_amount of its
+        from_token and receives required_amount of its to_token.
+        """
+        trade_amount = min(
+            OrderMatchingService.remaining_amount(order1),
+            OrderMatchingService.remaining_amount(order2) * order2.exchange_rate
+        )
+        required_amount = trade_amount / order2.exchange_rate
+        
+        return trade_amount, required_amount
     
     @staticmethod
-    def are_rates_compatible(order1: Order, order2: Order, tolerance: float = 0.05) -> bool:
-        expected_rate = 1.0 / order1.exchange_rate
-        actual_rate = order2.exchange_rate
+    def fill_order(order: Order, filled: float, counter_order: Optional[Order], matched_at: datetime):
+        order.filled_amount = (order.filled_amount or 0.0) + filled
+        order.matched_at = matched_at
+        if counter_order is not None:
+            order.matched_order_id = counter_order.id
         
-        return abs(expected_rate - actual_rate) / expected_rate <= tolerance
+        if OrderMatchingService.remaining_amount(order) <= FILL_EPSILON:
+            order.filled_amount = order.amount
+            order.status = TradeStatus.COMPLETED
     
     @staticmethod
-    def execute_matched_orders(order1: Order, order2: Order, db: Session) -> Trade:
-        trade_amount = min(order1.amount, order2.amount / order2.exchange_rate)
+    def settle_fill(order: Order, maker: Order, trade_amount: float, db: Session, matched_at: datetime) -> Trade:
+        """Settle order's owner sending trade_amount of maker.to_token to resting maker.
+        
+        The fill is priced at the maker's rate and the maker's remaining amount is
+        reduced in place. All four ledger legs are applied in the caller's
+        transaction; the caller fills order itself and commits.
+        """
+        required_amount = trade_amount / maker.exchange_rate
         
         trade = Trade(
-            creator_id=order1.user_id,
-            executor_id=order2.user_id,
-            from_token=order1.from_token,
-            to_token=order1.to_token,
-            exchange_rate=order1.exchange_rate,
+            creator_id=order.user_id,
+            executor_id=maker.user_id,
+            from_token=maker.to_token,
+            to_token=maker.from_token,
+            exchange_rate=1.0 / maker.exchange_rate,
             amount=trade_amount,
             status=TradeStatus.COMPLETED,
-            completed_at=datetime.utcnow()
+            completed_at=matched_at
         )
         
         db.add(trade)
         db.flush()
         
-        required_amount = trade_amount * order1.exchange_rate
+        TransactionService.apply_balance_legs([
+            BalanceLeg(
+                order.user_id, maker.to_token, -trade_amount, TransactionType.TRADE_SEND,
+                f"Order match #{trade.id}: Sent {trade_amount} {maker.to_token.value}"
+            ),
+            BalanceLeg(
+                order.user_id, maker.from_token, required_amount, TransactionType.TRADE_RECEIVE,
+                f"Order match #{trade.id}: Received {required_amount} {maker.from_token.value}"
+            ),
+            BalanceLeg(
+                maker.user_id, maker.from_token, -required_amount, TransactionType.TRADE_SEND,
+                f"Order match #{trade.id}: Sent {required_amount} {maker.from_token.value}"
+            ),
+            BalanceLeg(
+                maker.user_id, maker.to_token, trade_amount, TransactionType.TRADE_RECEIVE,
+                f"Order match #{trade.id}: Received {trade_amount} {maker.to_token.value}"
+            ),
+        ], db, related_trade_id=trade.id)
         
-        TransactionService.update_balance_with_history(
-            user_id=order1.user_id,
-            token_type=order1.from_token,
-            amount_change=-trade_amount,
-            transaction_type=TransactionType.TRADE_SEND,
-            db=db,
-            related_trade_id=trade.id,
-            description=f"Order match #{trade.id}: Sent {trade_amount} {order1.from_token.value}"
-        )
+        OrderMatchingService.fill_order(maker, required_amount, order, matched_at)
         
-        TransactionService.update_balance_with_history(
-            user_id=order1.user_id,
-            token_type=order1.to_token,
-            amount_change=required_amount,
-            transaction_type=TransactionType.TRADE_RECEIVE,
-            db=db,
-            related_trade_id=trade.id,
-            description=f"Order match #{trade.id}: Received {required_amount} {order1.to_token.value}"
-        )
+        return trade
+    
+    @staticmethod
+    def execute_matched_orders(order1: Order, order2: Order, db: Session) -> Trade:
+        """Fill order1 against resting order2, leaving any remainder on the same rows"""
+        trade_amount, _ = OrderMatchingService.calculate_fill(order1, order2)
+        matched_at = datetime.utcnow()
         
-        TransactionService.update_balance_with_history(
-            user_id=order2.user_id,
-            token_type=order2.from_token,
-            amount_change=-required_amount,
-            transaction_type=TransactionType.TRADE_SEND,
-            db=db,
-            related_trade_id=trade.id,
-            description=f"Order match #{trade.id}: Sent {required_amount} {order2.from_token.value}"
-        )
+        trade = OrderMatchingService.settle_fill(order1, order2, trade_amount, db, matched_at)
+        OrderMatchingService.fill_order(order1, trade_amount, order2, matched_at)
         
-        TransactionService.update_balance_with_history(
-            user_id=order2.user_id,
-            token_type=order2.to_token,
-            amount_change=trade_amount,
-            transaction_type=TransactionType.TRADE_RECEIVE,
-            db=db,
-            related_trade_id=trade.id,
-            description=f"Order match #{trade.id}: Received {trade_amount} {order2.to_token.value}"
-        )
+        return trade
+    
+    @staticmethod
+    def sweep_order(order: Order, db: Session, tolerance: float = 0.0) -> List[Trade]:
+        """Fill an order against the best resting counter orders up to its limit rate.
+
+        The limit is the order's stated rate; a positive tolerance opts in to
+        fills up to that fraction worse.
+        """
+        limit_rate = (1.0 + tolerance) / order.exchange_rate
         
-        order1.status = TradeStatus.COMPLETED
-        order1.matched_order_id = order2.id
-        order1.matched_at = datetime.utcnow()
-        
-        order2.status = TradeStatus.COMPLETED
-        order2.matched_order_id = order1.id
-        order2.matched_at = datetime.utcnow()
-        
-        if order1.amount > trade_amount:
-            remaining_order = Order(
-                user_id=order1.user_id,
-                from_token=order1.from_token,
-                to_token=order1.to_token,
-                amount=order1.amount - trade_amount,
-                exchange_rate=order1.exchange_rate,
-                status=TradeStatus.PENDING
-            )
-            db.add(remaining_order)
-        
-        if order2.amount > required_amount:
-            remaining_order = Order(
-                user_id=order2.user_id,
-                from_token=order2.from_token,
-                to_token=order2.to_token,
-                amount=order2.amount - required_amount,
-                exchange_rate=order2.exchange_rate,
-                status=TradeStatus.PENDING
+        with order_books.lock:
+            book = order_books.book(order.to_token, order.from_token, db)
+            candidates = [
+                entry.order_id for entry in book.iter_range(0.0, limit_rate)
+                if entry.user_id != order.user_id
+            ]
+        
+        trades = []
+        for order_id in candidates:
+            if OrderMatchingService.remaining_amount(order) <= FILL_EPSILON:
+                break
+            
+            matching_order = db.get(Order, order_id)
+            if matching_order is None or matching_order.status != TradeStatus.PENDING:
+                continue
+            
+            _, required_amount = OrderMatchingService.calculate_fill(order, matching_order)
+            counter_token = db.query(Token).filter(
+                Token.user_id == matching_order.user_id,
+                Token.token_type == matching_order.from_token
+            ).first()
+            
+            if not counter_token or counter_token.balance < required_amount:
+                logger.warning(f"Skipping order {matching_order.id}: insufficient {matching_order.from_token.value} balance")
+                continue
+            
+            trades.append(OrderMatchingService.execute_matched_orders(order, matching_order, db))
+        
+        return trades
+    
+    @staticmethod
+    def route_order(order: Order, db: Session, tolerance: float = 0.0) -> List[Trade]:
+        """Fill an order through 2- and 3-hop paths via other tokens.
+        
+        Each route fill settles one trade per leg; the intermediate tokens pass
+        through the order owner's balance and net out to zero. Routes must
+        reach the order's stated rate unless a positive tolerance opts in to
+        worse ones, as in sweep_order.
+        """
+        limit_rate = order.exchange_rate / (1.0 + tolerance)
+        trades = []
+        skipped: Set[int] = set()
+        
+        while OrderMatchingService.remaining_amount(order) > FILL_EPSILON:
+            route = order_router.best_route(order.from_token, order.to_token, order.user_id, db, excluded=skipped)
+            if route is None or route.rate < limit_rate:
+                break
+            
+            makers = [db.get(Order, entry.order_id) for entry in route.legs]
+            stale = [
+                entry.order_id for entry, maker in zip(route.legs, makers)
+                if maker is None or maker.status != TradeStatus.PENDING
+            ]
+            if stale:
+                skipped.update(stale)
+                continue
+            
+            amount = min(OrderMatchingService.remaining_amount(order), route.capacity)
+            leg_amounts = [amount]
+            for maker in makers[:-1]:
+                leg_amounts.append(leg_amounts[-1] / maker.exchange_rate)
+            
+            has_balance = True
+            for maker, leg_amount in zip(makers, leg_amounts):
+                maker_token = db.query(Token).filter(
+                    Token.user_id == maker.user_id,
+                    Token.token_type == maker.from_token
+                ).first()
+                if not maker_token or maker_token.balance < leg_amount / maker.exchange_rate:
+                    logger.warning(f"Skipping route via order {maker.id}: insufficient {maker.from_token.value} balance")
+                    skipped.add(maker.id)
+                    has_balance = False
+                    break
+            if not has_balance:
+                continue
+            
+            matched_at = datetime.utcnow()
+            for maker, leg_amount in zip(makers, leg_amounts):
+                trades.append(OrderMatchingService.settle_fill(order, maker, leg_amount, db, matched_at))
+            OrderMatchingService.fill_order(order, amount, makers[-1], matched_at)
+            db.flush()
+            
+            logger.info(
+                f"Routed order {order.id} via {' -> '.join(token.value for token in route.tokens)}: {amount} at {route.rate}"
             )
-            db.add(remaining_order)
         
-        return trade
+        return trades
+    
+    @staticmethod
+    def process_order(order: Order, db: Session) -> List[Trade]:
+        trades = OrderMatchingService.sweep_order(order, db)
+        trades += OrderMatchingService.route_order(order, db)
+        return trades
     
     @staticmethod
-    def process_order(order: Order, db: Session) -> Optional[Trade]:
-        matching_order = OrderMatchingService.find_matching_order(order, db)
+    def compute_clearing_rate(
+        sell_limits: np.ndarray,
+        sell_amounts: np.ndarray,
+        buy_limits: np.ndarray,
+        buy_amounts: np.ndarray
+    ) -> Optional[Tuple[float, float]]:
+        """Find the uniform rate that maximizes matched volume.
+        
+        Rates are quoted as quote tokens per base token. Sellers offer base
+        amounts at a minimum rate, buyers offer quote amounts at a maximum rate.
+        Supply only grows and demand only shrinks with the rate, so the rates
+        matching the most volume form one range [low, high]; the midpoint of
+        that range is returned, which never lies outside a filled order's limit.
+        Returns (rate, base_volume), or None if the book does not cross.
+        """
+        if len(sell_limits) == 0 or len(buy_limits) == 0:
+            return None
+        
+        rates = np.unique(np.concatenate([sell_limits, buy_limits]))
+        
+        sell_order = np.argsort(sell_limits)
+        sell_cumulative = np.concatenate([[0.0], np.cumsum(sell_amounts[sell_order])])
+        supply = sell_cumulative[np.searchsorted(sell_limits[sell_order], rates, side="right")]
+        
+        buy_order = np.argsort(buy_limits)
+        buy_cumulative = np.concatenate([[0.0], np.cumsum(buy_amounts[buy_order])])
+        quote = buy_cumulative[-1] - buy_cumulative[np.searchsorted(buy_limits[buy_order], rates, side="left")]
+        
+        # Volume peaks at a breakpoint: between two, supply is flat while demand falls
+        volume = np.minimum(supply, quote / rates)
+        best_volume = volume.max()
+        if best_volume <= FILL_EPSILON:
+            return None
+        
+        threshold = best_volume - FILL_EPSILON
+        low = rates[np.argmax(volume >= threshold)]
+        
+        # Buyers with limits >= rates[j] are the demand on (rates[j-1], rates[j]],
+        # which stays at least best_volume up to quote[j] / best_volume
+        previous = np.concatenate([[-np.inf], rates[:-1]])
+        highs = np.minimum(rates, quote / threshold)
+        high = highs[(highs >= previous) & (highs >= low)].max()
+        
+        return float((low + high) / 2.0), float(best_volume)
+    
+    @staticmethod
+    def allocate_fills(limits: np.ndarray, ids: np.ndarray, amounts: np.ndarray, total: float, descending: bool) -> np.ndarray:
+        """Split total across orders in price-time priority"""
+        priority = np.lexsort((ids, -limits if descending else limits))
+        cumulative = np.cumsum(amounts[priority])
+        fills = np.empty_like(amounts)
+        fills[priority] = np.clip(total - (cumulative - amounts[priority]), 0.0, amounts[priority])
+        return fills
+    
+    @staticmethod
+    def run_batch_auction(
+        base_token: TokenType,
+        quote_token: TokenType,
+        db: Session
+    ) -> Dict[int, Trade]:
+        """Clear all resting orders between two tokens at a single rate.
+        
+        Every crossing order is filled at the clearing rate, which lies within
+        every filled order's stated limit, and settled in the caller's
+        transaction. A book whose limits do not cross is left as it is.
+        Returns the Trade recorded for each filled order id.
+        """
+        with order_books.lock:
+            order_ids = [
+                entry.order_id
+                for pair in ((base_token, quote_token), (quote_token, base_token))
+                for entry in order_books.book(pair[0], pair[1], db).iter_range(0.0, float("inf"))
+            ]
+        
+        if not order_ids:
+            return {}
         
-        if matching_order:
-            return OrderMatchingService.execute_matched_orders(order, matching_order, db)
+        orders = db.query(Order).filter(
+            Order.id.in_(order_ids),
+            Order.status == TradeStatus.PENDING
+        ).order_by(Order.id).all()
+        
+        user_ids = {order.user_id for order in orders}
+        available = {
+            (user_id, token_type): balance
+            for user_id, token_type, balance in db.query(Token.user_id, Token.token_type, Token.balance).filter(
+                Token.user_id.in_(user_ids),
+                Token.token_type.in_([base_token, quote_token])
+            ).all()
+        }
+        
+        sells, buys = [], []
+        for order in orders:
+            remaining = OrderMatchingService.remaining_amount(order)
+            key = (order.user_id, order.from_token)
+            if available.get(key, 0.0) < remaining:
+                continue
+            available[key] -= remaining
+            
+            if order.from_token == base_token:
+                sells.append((order, order.exchange_rate, remaining))
+            else:
+                buys.append((order, 1.0 / order.exchange_rate, remaining))
+        
+        sell_amounts = np.array([amount for _, _, amount in sells], dtype=float)
+        buy_amounts = np.array([amount for _, _, amount in buys], dtype=float)
+        
+        sell_limits = np.array([limit for _, limit, _ in sells], dtype=float)
+        buy_limits = np.array([limit for _, limit, _ in buys], dtype=float)
+        clearing = OrderMatchingService.compute_clearing_rate(sell_limits, sell_amounts, buy_limits, buy_amounts)
+        if clearing is None:
+            return {}
+        
+        rate, volume = clearing
+        sell_fills = OrderMatchingService.allocate_fills(
+            sell_limits, np.array([order.id for order, _, _ in sells]), sell_amounts, volume, descending=False
+        )
+        buy_fills = OrderMatchingService.allocate_fills(
+            buy_limits, np.array([order.id for order, _, _ in buys]), buy_amounts, volume * rate, descending=True
+        )
+        
+        fills = [
+            (order, sent, sent * rate, rate)
+            for (order, _, _), sent in zip(sells, sell_fills) if sent > FILL_EPSILON
+        ] + [
+            (order, sent, sent / rate, 1.0 / rate)
+            for (order, _, _), sent in zip(buys, buy_fills) if sent > FILL_EPSILON
+        ]
+        
+        matched_at = datetime.utcnow()
+        trades = {}
+        for order, sent, received, order_rate in fills:
+            trades[order.id] = Trade(
+                creator_id=order.user_id,
+                from_token=order.from_token,
+                to_token=order.to_token,
+                exchange_rate=order_rate,
+                amount=sent,
+                status=TradeStatus.COMPLETED,
+                completed_at=matched_at
+            )
+        db.add_all(trades.values())
+        db.flush()
+        
+        for order, sent, received, _ in fills:
+            trade = trades[order.id]
+            TransactionService.apply_balance_legs([
+                BalanceLeg(
+                    order.user_id, order.from_token, -sent, TransactionType.TRADE_SEND,
+                    f"Batch auction #{trade.id}: Sent {sent} {order.from_token.value}"
+                ),
+                BalanceLeg(
+                    order.user_id, order.to_token, received, TransactionType.TRADE_RECEIVE,
+                    f"Batch auction #{trade.id}: Received {received} {order.to_token.value}"
+                ),
+            ], db, related_trade_id=trade.id)
+            
+            OrderMatchingService.fill_order(order, sent, None, matched_at)
+        
+        db.flush()
+        logger.info(
+            f"Batch auction {base_token.value}/{quote_token.value}: cleared {volume} at {rate} across {len(fills)} orders"
+        )
         
-        return None
+        return trades
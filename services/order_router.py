@@ -0,0 +1,104 @@
+from sqlalchemy.orm import Session
+from models import TokenType
+from services.order_book import BookEntry, OrderBook, Pair, order_books
+from dataclasses import dataclass
+from itertools import permutations
+from typing import AbstractSet, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Route:
+    tokens: Tuple[TokenType, ...]
+    legs: List[BookEntry]
+    rate: float
+    capacity: float
+
+class OrderRouter:
+    """Best-offer graph over every token pair, used to route orders via other tokens.
+
+    The edge from_token -> to_token is the best resting order in the
+    (to_token, from_token) book, i.e. the cheapest way to turn from_token into
+    to_token. Edges are updated from order book change notifications, so
+    finding a route only compares the handful of 2- and 3-hop paths. When the
+    best offer on an edge is the taker's own or excluded (e.g. unfunded), the
+    edge falls back to the next entry of its book in priority order.
+    """
+
+    def __init__(self):
+        self._edges: Dict[Pair, BookEntry] = {}
+        order_books.subscribe(self._on_book_change)
+
+    def _on_book_change(self, book: OrderBook):
+        edge = (book.pair[1], book.pair[0])
+        best = book.best()
+        if best is None:
+            self._edges.pop(edge, None)
+        else:
+            self._edges[edge] = best
+
+    def _load_books(self, db: Session):
+        for from_token, to_token in permutations(TokenType, 2):
+            order_books.book(from_token, to_token, db)
+
+    def edge_rate(self, from_token: TokenType, to_token: TokenType) -> Optional[float]:
+        """Units of to_token received per from_token at the best resting offer"""
+        best = self._edges.get((from_token, to_token))
+        return 1.0 / best.exchange_rate if best is not None else None
+
+    def best_route(
+        self,
+        from_token: TokenType,
+        to_token: TokenType,
+        user_id: int,
+        db: Session,
+        max_hops: int = 3,
+        excluded: AbstractSet[int] = frozenset()
+    ) -> Optional[Route]:
+        """Best 2..max_hops path that avoids the user's own resting orders and excluded order ids"""
+        best_route = None
+
+        with order_books.lock:
+            self._load_books(db)
+            intermediates = [token for token in TokenType if token not in (from_token, to_token)]
+
+            for hops in range(2, max_hops + 1):
+                for middle in permutations(intermediates, hops - 1):
+                    tokens = (from_token, *middle, to_token)
+                    route = self._evaluate(tokens, user_id, excluded)
+                    if route is not None and (best_route is None or route.rate > best_route.rate):
+                        best_route = route
+
+        return best_route
+
+    def _edge(self, leg_from: TokenType, leg_to: TokenType, user_id: int, excluded: AbstractSet[int]) -> Optional[BookEntry]:
+        """Best offer on an edge from another user, walking the book past ineligible entries"""
+        entry = self._edges.get((leg_from, leg_to))
+        if entry is None or (entry.user_id != user_id and entry.order_id not in excluded):
+            return entry
+
+        book = order_books.loaded_book(leg_to, leg_from)
+        if book is None:
+            return None
+        for entry in book.iter_range(0.0, float("inf")):
+            if entry.user_id != user_id and entry.order_id not in excluded:
+                return entry
+        return None
+
+    def _evaluate(self, tokens: Tuple[TokenType, ...], user_id: int, excluded: AbstractSet[int]) -> Optional[Route]:
+        legs = []
+        rate = 1.0
+        capacity = float("inf")
+
+        for leg_from, leg_to in zip(tokens, tokens[1:]):
+            entry = self._edge(leg_from, leg_to, user_id, excluded)
+            if entry is None:
+                return None
+            capacity = min(capacity, entry.amount * entry.exchange_rate / rate)
+            rate /= entry.exchange_rate
+            legs.append(entry)
+
+        return Route(tokens=tokens, legs=legs, rate=rate, capacity=capacity)
+
+order_router = OrderRouter()
@@ -0,0 +1,335 @@
+from sqlalchemy import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import SessionLocal
+from models import MarketPrice, MarketPriceHistory, TokenType
+from services.conversion_service import CrossRateCache, cross_rates
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+import asyncio
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRICE_FEED_SOURCE = os.getenv("PRICE_FEED_SOURCE")
+PRICE_FEED_FLUSH_SECONDS = float(os.getenv("PRICE_FEED_FLUSH_SECONDS", "1.0"))
+
+@dataclass
+class PriceTick:
+    token_type: TokenType
+    price_btc: float
+    price_usd: float
+    timestamp: datetime
+
+def parse_tick(line: str) -> PriceTick:
+    """Parse one JSON tick, e.g. {"token_type": "openai", "price_btc": 1e-06, "price_usd": 0.05}
+
+    timestamp is optional (ISO 8601, UTC when naive) and defaults to now. It
+    is normalized to UTC, since the history column does not keep the offset.
+    """
+    data = json.loads(line)
+    price_btc = float(data["price_btc"])
+    price_usd = float(data["price_usd"])
+    if not (price_btc > 0 and price_usd > 0):
+        raise ValueError("Prices must be positive")
+
+    timestamp = data.get("timestamp")
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc)
+    else:
+        timestamp = datetime.fromisoformat(timestamp)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        else:
+            timestamp = timestamp.astimezone(timezone.utc)
+
+    return PriceTick(TokenType(data["token_type"]), price_btc, price_usd, timestamp)
+
+class TickSource(ABC):
+    """Blocking source of tick lines, read on a background thread"""
+
+    @abstractmethod
+    def lines(self) -> Iterator[str]:
+        ...
+
+    def close(self):
+        pass
+
+class FileTickSource(TickSource):
+    """Reads a file of JSON lines, following appends like tail -f when follow is set"""
+
+    def __init__(self, path: str, follow: bool = True, poll_interval: float = 0.2):
+        self.path = path
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self._closed = threading.Event()
+
+    def lines(self) -> Iterator[str]:
+        with open(self.path) as f:
+            partial = ""
+            while not self._closed.is_set():
+                line = f.readline()
+                if line.endswith("\n"):
+                    yield partial + line
+                    partial = ""
+                elif line:
+                    partial += line
+                elif self.follow:
+                    self._closed.wait(self.poll_interval)
+                else:
+                    break
+            if partial and not self.follow:
+                yield partial
+
+    def close(self):
+        self._closed.set()
+
+class StdinTickSource(TickSource):
+    def lines(self) -> Iterator[str]:
+        yield from sys.stdin
+
+class CommandTickSource(TickSource):
+    """Runs a feed process and reads ticks from its stdout"""
+
+    def __init__(self, command: str):
+        self.command = command
+        self._process: Optional[subprocess.Popen] = None
+
+    def lines(self) -> Iterator[str]:
+        self._process = subprocess.Popen(shlex.split(self.command), stdout=subprocess.PIPE, text=True)
+        yield from self._process.stdout
+        self._process.wait()
+
+    def close(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+
+def tick_source(spec: str) -> TickSource:
+    """Build a source from "stdin", "file:<path>" or "command:<command line>" """
+    if spec == "stdin":
+        return StdinTickSource()
+    if spec.startswith("file:"):
+        return FileTickSource(spec[len("file:"):])
+    if spec.startswith("command:"):
+        return CommandTickSource(spec[len("command:"):])
+    raise ValueError(f"Unknown price feed source: {spec}")
+
+class PriceFeed:
+    """Ingests market price ticks into market_prices and market_price_history.
+
+    A reader thread parses ticks from the source and coalesces them per
+    token, keeping only the newest. Every flush_interval seconds the pending
+    ticks are written in one transaction: one market_price_history row per
+    token (with the number of ticks it stands for) and an upsert of its
+    market_prices row. Committing that transaction invalidates the cross-rate
+    cache through the market price listeners in conversion_service, so a
+    burst of ticks costs one write and one cache rebuild per interval. Run
+    standalone, the API process notices the new history rows on its next
+    market price poll instead.
+    """
+
+    def __init__(self, source: Optional[str], flush_interval: float = 1.0):
+        self.source = source
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[TokenType, PriceTick] = {}
+        self._counts: Dict[TokenType, int] = {}
+        self._applied: Dict[TokenType, datetime] = {}
+        self._reader: Optional[threading.Thread] = None
+        self._tick_source: Optional[TickSource] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.source)
+
+    def offer(self, tick: PriceTick) -> bool:
+        """Queue a tick, returning False if it is older than what is already applied or pending"""
+        with self._lock:
+            applied = self._applied.get(tick.token_type)
+            pending = self._pending.get(tick.token_type)
+            if applied is not None and tick.timestamp <= applied:
+                return False
+            if pending is not None and tick.timestamp < pending.timestamp:
+                return False
+            self._pending[tick.token_type] = tick
+            self._counts[tick.token_type] = self._counts.get(tick.token_type, 0) + 1
+            return True
+
+    def _read(self, source: TickSource):
+        try:
+            for line in source.lines():
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self.offer(parse_tick(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"Skipping malformed price tick {line!r}: {e}")
+        except Exception:
+            logger.exception("Price feed source failed")
+        logger.info(f"Price feed source {self.source} ended")
+
+    def flush(self) -> int:
+        """Apply the pending ticks in one transaction, returning the number of tokens updated"""
+        with self._lock:
+            pending, counts = self._pending, self._counts
+            self._pending, self._counts = {}, {}
+        if not pending:
+            return 0
+
+        ticks: List[PriceTick] = sorted(pending.values(), key=lambda tick: tick.token_type.value)
+        db = SessionLocal()
+        try:
+            db.execute(insert(MarketPriceHistory), [
+                {
+                    "token_type": tick.token_type,
+                    "price_btc": tick.price_btc,
+                    "price_usd": tick.price_usd,
+                    "tick_count": counts[tick.token_type],
+                    "recorded_at": tick.timestamp
+                }
+                for tick in ticks
+            ])
+            stmt = sqlite_insert(MarketPrice).values([
+                {
+                    "token_type": tick.token_type,
+                    "price_btc": tick.price_btc,
+                    "price_usd": tick.price_usd,
+                    "last_updated": tick.timestamp
+                }
+                for tick in ticks
+            ])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["token_type"],
+                set_={
+                    "price_btc": stmt.excluded.price_btc,
+                    "price_usd": stmt.excluded.price_usd,
+                    "last_updated": stmt.excluded.last_updated
+                }
+            ))
+            stored_version = CrossRateCache.stored_version(db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                for token_type, tick in pending.items():
+                    newer = self._pending.get(token_type)
+                    if newer is None or newer.timestamp < tick.timestamp:
+                        self._pending[token_type] = tick
+                    self._counts[token_type] = self._counts.get(token_type, 0) + counts[token_type]
+            raise
+        finally:
+            db.close()
+
+        # The commit invalidated the cross rates already; keep the poll from doing it again
+        cross_rates.note_stored_version(stored_version)
+        with self._lock:
+            for tick in ticks:
+                self._applied[tick.token_type] = tick.timestamp
+        logger.debug(f"Applied {sum(counts.values())} price ticks to {len(ticks)} tokens")
+        return len(ticks)
+
+    def _start_reader(self):
+        self._tick_source = tick_source(self.source)
+        self._reader = threading.Thread(
+            target=self._read, args=(self._tick_source,), name="price-feed", daemon=True
+        )
+        self._reader.start()
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self._start_reader()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Price feed started from {self.source}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._tick_source.close()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.flush()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception:
+                logger.exception("Price feed flush failed")
+
+    def run(self):
+        """Ingest in the foreground until the source ends"""
+        self._start_reader()
+        try:
+            while self._reader.is_alive():
+                self._reader.join(self.flush_interval)
+                self.flush()
+        finally:
+            self._tick_source.close()
+            self.flush()
+
+price_feed = PriceFeed(PRICE_FEED_SOURCE, flush_interval=PRICE_FEED_FLUSH_SECONDS)
+
+def stub_ticks(interval: float, volatility: float, count: Optional[int], seed: Optional[int]):
+    """Print random-walk ticks starting from the current market prices, one JSON line each"""
+    import numpy as np
+
+    db = SessionLocal()
+    try:
+        prices = {row.token_type: (row.price_btc, row.price_usd) for row in db.query(MarketPrice)}
+    finally:
+        db.close()
+    if not prices:
+        sys.exit("No market prices to start from")
+
+    rng = np.random.default_rng(seed)
+    tokens = list(prices)
+    emitted = 0
+    while count is None or emitted < count:
+        token_type = tokens[rng.integers(len(tokens))]
+        step = float(np.exp(rng.normal(0.0, volatility)))
+        price_btc, price_usd = prices[token_type]
+        prices[token_type] = (price_btc * step, price_usd * step)
+        print(json.dumps({
+            "token_type": token_type.value,
+            "price_btc": prices[token_type][0],
+            "price_usd": prices[token_type][1],
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }), flush=True)
+        emitted += 1
+        if interval > 0:
+            time.sleep(interval)
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Market price tick ingestion")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    ingest = subcommands.add_parser("ingest", help="Ingest ticks until the source ends")
+    ingest.add_argument("source", help='"stdin", "file:<path>" or "command:<command line>"')
+    ingest.add_argument("--flush-interval", type=float, default=PRICE_FEED_FLUSH_SECONDS)
+    stub = subcommands.add_parser("stub", help="Print a random-walk feed to stdout")
+    stub.add_argument("--interval", type=float, default=0.1, help="Seconds between ticks")
+    stub.add_argument("--volatility", type=float, default=0.001, help="Standard deviation of each log-price step")
+    stub.add_argument("--count", type=int, help="Stop after this many ticks")
+    stub.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.command == "stub":
+        stub_ticks(args.interval, args.volatility, args.count, args.seed)
+    else:
+        PriceFeed(args.source, flush_interval=args.flush_interval).run()
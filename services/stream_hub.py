@@ -0,0 +1,244 @@
+from database import SessionLocal
+from models import MarketPrice, TokenType
+from services.conversion_service import cross_rates
+from services.order_book import order_books, OrderChange
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "1000"))
+STREAM_DEPTH_LEVELS = int(os.getenv("STREAM_DEPTH_LEVELS", "10"))
+
+PRICES = "prices"
+ORDERS = "orders"
+
+def book_topic(from_token: TokenType, to_token: TokenType) -> str:
+    return f"book:{from_token.value}:{to_token.value}"
+
+def parse_book_topic(topic: str) -> Optional[Tuple[TokenType, TokenType]]:
+    parts = topic.split(":")
+    if len(parts) != 3 or parts[0] != "book":
+        return None
+    try:
+        pair = (TokenType(parts[1]), TokenType(parts[2]))
+    except ValueError:
+        return None
+    return pair if pair[0] != pair[1] else None
+
+def orders_topic(user_id: int) -> str:
+    return f"orders:{user_id}"
+
+class Subscription:
+    """One connection's queue of serialized messages.
+
+    A connection that falls queue_size messages behind is closed rather than
+    buffering without bound; closed is set and a final None is queued.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.topics: Set[str] = set()
+        self.closed = False
+
+    def put(self, message: str):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+class StreamHub:
+    """In-process pub/sub feeding the WebSocket and SSE streams.
+
+    Topics are "prices", "book:<from>:<to>" (depth of one order book) and
+    "orders:<user_id>" (a user's order and fill events). publish() may be
+    called from any thread: the message is serialized once there and handed
+    to the event loop, which puts the same string on every subscriber's
+    queue. Price and book topics keep their latest message, which new
+    subscribers receive first.
+
+    Publishers are the existing commit hooks: committed market price changes
+    (via the cross-rate cache) reload prices once per change, and committed
+    order changes publish the depth of each touched book that has
+    subscribers plus an event per order to its owner.
+    """
+
+    def __init__(self, queue_size: int = 1000, depth_levels: int = 10):
+        self.queue_size = queue_size
+        self.depth_levels = depth_levels
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._latest: Dict[str, str] = {}
+        self._prices_pending = False
+
+        cross_rates.subscribe(self._prices_changed)
+        order_books.subscribe_commits(self._orders_committed)
+
+    @property
+    def is_running(self) -> bool:
+        return self._loop is not None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._prices_changed()
+
+    async def stop(self):
+        for subscriptions in list(self._subscribers.values()):
+            for subscription in list(subscriptions):
+                subscription.close()
+        self._subscribers.clear()
+        self._latest.clear()
+        self._loop = None
+
+    def subscribe(self, subscription: Subscription, topic: str):
+        """Add a topic to a subscription (event loop only)"""
+        if topic in subscription.topics:
+            return
+        subscription.topics.add(topic)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+        latest = self._latest.get(topic)
+        if latest is not None:
+            subscription.put(latest)
+        elif topic.startswith("book:"):
+            self._loop.create_task(self._load_book(parse_book_topic(topic)))
+
+    def unsubscribe(self, subscription: Subscription, topic: Optional[str] = None):
+        """Remove one topic, or every topic, from a subscription (event loop only)"""
+        topics = [topic] if topic is not None else list(subscription.topics)
+        for name in topics:
+            subscription.topics.discard(name)
+            subscribers = self._subscribers.get(name)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[name]
+                if name.startswith("book:"):
+                    self._latest.pop(name, None)
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self._subscribers.get(topic))
+
+    def publish(self, topic: str, channel: str, data, keep_latest: bool = False):
+        """Serialize one message and fan it out to the topic's subscribers (thread-safe)"""
+        loop = self._loop
+        if loop is None:
+            return
+        message = json.dumps({"channel": channel, "data": data}, separators=(",", ":"))
+        loop.call_soon_threadsafe(self._fan_out, topic, message, keep_latest)
+
+    def _fan_out(self, topic: str, message: str, keep_latest: bool):
+        subscribers = self._subscribers.get(topic)
+        if keep_latest and (topic == PRICES or subscribers):
+            self._latest[topic] = message
+        if not subscribers:
+            return
+        for subscription in list(subscribers):
+            subscription.put(message)
+            if subscription.closed:
+                logger.warning(f"Closing stream subscriber more than {self.queue_size} messages behind")
+                self.unsubscribe(subscription)
+
+    def _prices_changed(self):
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._schedule_prices)
+
+    def _schedule_prices(self):
+        # Coalesce bursts of price commits into one reload
+        if self._prices_pending or self._loop is None:
+            return
+        self._prices_pending = True
+        self._loop.create_task(self._publish_prices())
+
+    async def _publish_prices(self):
+        self._prices_pending = False
+        try:
+            prices = await self._loop.run_in_executor(None, _load_prices)
+        except Exception:
+            logger.exception("Failed to publish market prices")
+            return
+        self.publish(PRICES, PRICES, prices, keep_latest=True)
+
+    async def _load_book(self, pair: Tuple[TokenType, TokenType]):
+        try:
+            depth = await self._loop.run_in_executor(None, self._load_depth, pair)
+        except Exception:
+            logger.exception(f"Failed to load order book {pair[0].value} -> {pair[1].value}")
+            return
+        topic = book_topic(*pair)
+        self.publish(topic, topic, depth, keep_latest=True)
+
+    def _load_depth(self, pair: Tuple[TokenType, TokenType]) -> dict:
+        db = SessionLocal()
+        try:
+            with order_books.lock:
+                return self._depth(pair, order_books.book(pair[0], pair[1], db).depth(self.depth_levels))
+        finally:
+            db.close()
+
+    @staticmethod
+    def _depth(pair: Tuple[TokenType, TokenType], depth: List[Tuple[float, float, int]]) -> dict:
+        return {
+            "from_token": pair[0].value,
+            "to_token": pair[1].value,
+            "levels": [
+                {"exchange_rate": rate, "amount": amount, "order_count": count}
+                for rate, amount, count in depth
+            ]
+        }
+
+    def _orders_committed(self, changes: List[OrderChange]):
+        # Called under the order book lock, so the books already reflect the changes
+        if self._loop is None:
+            return
+
+        for pair in {change.entry.pair for change in changes}:
+            topic = book_topic(*pair)
+            book = order_books.loaded_book(*pair)
+            if book is not None and self.has_subscribers(topic):
+                self.publish(topic, topic, self._depth(pair, book.depth(self.depth_levels)), keep_latest=True)
+
+        for change in changes:
+            entry = change.entry
+            if not self.has_subscribers(orders_topic(entry.user_id)):
+                continue
+            self.publish(orders_topic(entry.user_id), ORDERS, {
+                "event": change.event,
+                "order_id": entry.order_id,
+                "from_token": entry.from_token.value,
+                "to_token": entry.to_token.value,
+                "remaining_amount": entry.amount,
+                "exchange_rate": entry.exchange_rate,
+                "resting": change.resting
+            })
+
+def _load_prices() -> List[dict]:
+    db = SessionLocal()
+    try:
+        return [
+            {
+                "token_type": price.token_type.value,
+                "price_btc": price.price_btc,
+                "price_usd": price.price_usd,
+                "last_updated": price.last_updated.isoformat() if price.last_updated else None
+            }
+            for price in db.query(MarketPrice).order_by(MarketPrice.id)
+        ]
+    finally:
+        db.close()
+
+stream_hub = StreamHub(queue_size=STREAM_QUEUE_SIZE, depth_levels=STREAM_DEPTH_LEVELS)
@@ -1,44 +1,83 @@
+from sqlalchemy import Date, String, case, func, insert, literal, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from models import TransactionHistory, BalanceSnapshot, Token, User, TokenType, TransactionType
-from datetime import datetime, date
-from typing import Optional
+from database import SessionLocal
+from services.history_archive import history_archive
+from models import (
+    TransactionHistory, BalanceSnapshot, BalanceRollup, BalanceResolution, Token, User, TokenType, TransactionType
+)
+from dataclasses import dataclass
+from datetime import datetime, date, timedelta, timezone
+from typing import Iterator, List, Optional
+import base64
 import logging
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class BalanceLeg:
+    user_id: int
+    token_type: TokenType
+    amount_change: float
+    transaction_type: TransactionType
+    description: Optional[str] = None
+
 class TransactionService:
     
     @staticmethod
-    def log_transaction(
-        user_id: int,
-        token_type: TokenType,
-        transaction_type: TransactionType,
-        amount: float,
-        balance_before: float,
-        balance_after: float,
+    def apply_balance_legs(
+        legs: List[BalanceLeg],
         db: Session,
-        related_trade_id: Optional[int] = None,
-        description: Optional[str] = None
-    ) -> TransactionHistory:
-        """Log a transaction to the transaction history"""
-        transaction = TransactionHistory(
-            user_id=user_id,
-            token_type=token_type,
-            transaction_type=transaction_type,
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            related_trade_id=related_trade_id,
-            description=description
-        )
+        related_trade_id: Optional[int] = None
+    ) -> List[float]:
+        """Apply every balance leg of a settlement inside the caller's transaction.
         
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
+        Each leg is a conditional UPDATE that refuses to take a balance below
+        zero, and the history rows are written in one bulk INSERT. Nothing is
+        committed; the caller commits once for the whole settlement. Raises
+        ValueError on insufficient balance, leaving the rollback to the caller.
+        Returns the balance after each leg.
+        """
+        history = []
+        balances_after = []
         
-        logger.info(f"Logged transaction: User {user_id}, {token_type.value}, {transaction_type.value}, Amount: {amount}")
+        for leg in legs:
+            statement = update(Token).where(
+                Token.user_id == leg.user_id,
+                Token.token_type == leg.token_type
+            )
+            if leg.amount_change < 0:
+                statement = statement.where(Token.balance + leg.amount_change >= 0)
+            
+            balance_after = db.execute(
+                statement.values(balance=Token.balance + leg.amount_change).returning(Token.balance),
+                execution_options={"synchronize_session": "fetch"}
+            ).scalar_one_or_none()
+            
+            if balance_after is None:
+                if leg.amount_change < 0:
+                    raise ValueError(
+                        f"Insufficient {leg.token_type.value} balance for user {leg.user_id}: {leg.amount_change}"
+                    )
+                db.add(Token(user_id=leg.user_id, token_type=leg.token_type, balance=leg.amount_change))
+                db.flush()
+                balance_after = leg.amount_change
+            
+            history.append({
+                "user_id": leg.user_id,
+                "token_type": leg.token_type,
+                "transaction_type": leg.transaction_type,
+                "amount": leg.amount_change,
+                "balance_before": balance_after - leg.amount_change,
+                "balance_after": balance_after,
+                "related_trade_id": related_trade_id,
+                "description": leg.description
+            })
+            balances_after.append(balance_after)
         
-        return transaction
+        db.execute(insert(TransactionHistory), history)
+        
+        return balances_after
     
     @staticmethod
     def update_balance_with_history(
@@ -49,105 +88,302 @@ class TransactionService:
         db: Session,
         related_trade_id: Optional[int] = None,
         description: Optional[str] = None
-    ) -> Token:
-        """Update token balance and log the transaction"""
-        token = db.query(Token).filter(
-            Token.user_id == user_id,
-            Token.token_type == token_type
-        ).first()
-        
-        if not token:
-            token = Token(
-                user_id=user_id,
-                token_type=token_type,
-                balance=0.0
-            )
-            db.add(token)
-            db.flush()
-        
-        balance_before = token.balance
-        balance_after = balance_before + amount_change
-        
-        if balance_after < 0:
-            raise ValueError(f"Insufficient balance: {balance_before} + {amount_change} = {balance_after}")
-        
-        token.balance = balance_after
-        
-        TransactionService.log_transaction(
-            user_id=user_id,
-            token_type=token_type,
-            transaction_type=transaction_type,
-            amount=amount_change,
-            balance_before=balance_before,
-            balance_after=balance_after,
-            db=db,
-            related_trade_id=related_trade_id,
-            description=description
-        )
-        
+    ) -> float:
+        """Update a single token balance, log the transaction and commit"""
+        leg = BalanceLeg(user_id, token_type, amount_change, transaction_type, description)
+        (balance_after,) = TransactionService.apply_balance_legs([leg], db, related_trade_id)
         db.commit()
-        db.refresh(token)
         
-        return token
+        return balance_after
     
     @staticmethod
     def create_daily_balance_snapshot(user_id: int, db: Session):
-        """Create daily balance snapshots for a user"""
-        today = date.today()
-        
-        existing_snapshots = db.query(BalanceSnapshot).filter(
-            BalanceSnapshot.user_id == user_id,
-            BalanceSnapshot.snapshot_date == today
-        ).count()
-        
-        if existing_snapshots > 0:
+        """Create today's balance snapshots for a user, as of the start of the day like the scheduler"""
+        today = datetime.now(timezone.utc).date()
+        created = TransactionService.snapshot_all_balances(today, db, user_id=user_id)
+        db.commit()
+
+        if created == 0:
             logger.info(f"Balance snapshots already exist for user {user_id} on {today}")
             return
-        
-        user_tokens = db.query(Token).filter(Token.user_id == user_id).all()
-        
-        for token in user_tokens:
-            snapshot = BalanceSnapshot(
-                user_id=user_id,
-                token_type=token.token_type,
-                balance=token.balance,
-                snapshot_date=today
-            )
-            db.add(snapshot)
-        
-        db.commit()
         logger.info(f"Created daily balance snapshots for user {user_id}")
     
+    @staticmethod
+    def snapshot_all_balances(snapshot_date: date, db: Session, user_id: Optional[int] = None) -> int:
+        """Snapshot every token balance (or one user's) as of the start of snapshot_date (UTC).
+
+        One INSERT ... SELECT over tokens: each balance is rolled back by the
+        ledger entries since the start of the day, so missed days can be
+        backfilled after the fact. Balances that already have a snapshot for
+        the date are skipped. Does not commit; returns the rows inserted.
+        """
+        # Compared as text so that rows stamped exactly at midnight count as
+        # part of the day (a bound datetime renders with microseconds on SQLite)
+        day_start = literal(snapshot_date.isoformat(), String)
+        since = select(func.coalesce(func.sum(TransactionHistory.amount), 0.0)).where(
+            TransactionHistory.user_id == Token.user_id,
+            TransactionHistory.token_type == Token.token_type,
+            TransactionHistory.created_at >= day_start
+        ).correlate(Token).scalar_subquery()
+
+        existing = select(BalanceSnapshot.id).where(
+            BalanceSnapshot.user_id == Token.user_id,
+            BalanceSnapshot.token_type == Token.token_type,
+            BalanceSnapshot.snapshot_date == snapshot_date
+        ).correlate(Token).exists()
+
+        rows = select(
+            Token.user_id, Token.token_type, Token.balance - since, literal(snapshot_date, Date)
+        ).where(~existing)
+        if user_id is not None:
+            rows = rows.where(Token.user_id == user_id)
+
+        result = db.execute(
+            insert(BalanceSnapshot).from_select(
+                ["user_id", "token_type", "balance", "snapshot_date"], rows
+            )
+        )
+        TransactionService.apply_balance_rollups(snapshot_date, db, user_id=user_id)
+        return result.rowcount
+
+    @staticmethod
+    def apply_balance_rollups(snapshot_date: date, db: Session, user_id: Optional[int] = None):
+        """Fold the snapshots of one day into the weekly and monthly rollups.
+
+        One upsert per resolution. Re-applying a day is harmless and days may
+        arrive out of order: open and close only move for an earlier or later
+        day than the rollup has seen.
+        """
+        periods = {
+            BalanceResolution.WEEK: snapshot_date - timedelta(days=snapshot_date.weekday()),
+            BalanceResolution.MONTH: snapshot_date.replace(day=1),
+        }
+        day = literal(snapshot_date, Date)
+
+        for resolution, period_start in periods.items():
+            rows = select(
+                BalanceSnapshot.user_id,
+                BalanceSnapshot.token_type,
+                literal(resolution, BalanceRollup.resolution.type),
+                literal(period_start, Date),
+                day,
+                day,
+                BalanceSnapshot.balance,
+                BalanceSnapshot.balance,
+                BalanceSnapshot.balance,
+                BalanceSnapshot.balance
+            ).where(BalanceSnapshot.snapshot_date == snapshot_date)
+            if user_id is not None:
+                rows = rows.where(BalanceSnapshot.user_id == user_id)
+
+            stmt = sqlite_insert(BalanceRollup).from_select(
+                [
+                    "user_id", "token_type", "resolution", "period_start", "first_date",
+                    "last_date", "open", "high", "low", "close"
+                ],
+                rows
+            )
+            new = stmt.excluded
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["user_id", "resolution", "token_type", "period_start"],
+                set_={
+                    "open": case((new.first_date < BalanceRollup.first_date, new.open), else_=BalanceRollup.open),
+                    "first_date": case((new.first_date < BalanceRollup.first_date, new.first_date), else_=BalanceRollup.first_date),
+                    "close": case((new.last_date >= BalanceRollup.last_date, new.close), else_=BalanceRollup.close),
+                    "last_date": case((new.last_date > BalanceRollup.last_date, new.last_date), else_=BalanceRollup.last_date),
+                    "high": case((new.high > BalanceRollup.high, new.high), else_=BalanceRollup.high),
+                    "low": case((new.low < BalanceRollup.low, new.low), else_=BalanceRollup.low),
+                }
+            ))
+
+    @staticmethod
+    def rebuild_balance_rollups(db: Session) -> int:
+        """Recompute every rollup from the stored snapshots, returning the days folded in"""
+        db.query(BalanceRollup).delete(synchronize_session=False)
+        days = [
+            row[0] for row in
+            db.query(BalanceSnapshot.snapshot_date).distinct().order_by(BalanceSnapshot.snapshot_date)
+        ]
+        for snapshot_date in days:
+            TransactionService.apply_balance_rollups(snapshot_date, db)
+        return len(days)
+
     @staticmethod
     def get_user_transaction_history(
         user_id: int,
         db: Session,
         token_type: Optional[TokenType] = None,
-        limit: int = 100
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> list[TransactionHistory]:
+        """Get a page of transaction history for a user, newest first.
+
+        Pass the cursor of the last row of the previous page to continue after
+        it. Pages are seeked on (created_at, id), so every page costs the same
+        index range scan however deep it is. Pages continue transparently into
+        archived history.
+        """
+        last_id = TransactionService.decode_cursor(cursor) if cursor else None
+
+        # The hot table, then archive partitions newest first, form one
+        # continuous order; start in whichever of them holds the cursor row
+        sources = [None] + history_archive.partitions(newest_first=True)
+        if last_id is not None:
+            in_hot_table = db.query(TransactionHistory.id).filter(TransactionHistory.id == last_id).first()
+            start = None if in_hot_table else history_archive.locate(last_id)
+            if start is None and not in_hot_table:
+                raise ValueError("Invalid pagination cursor")
+            sources = sources[sources.index(start):]
+
+        transactions = []
+        for partition in sources:
+            if len(transactions) >= limit:
+                break
+            source_db = db if partition is None else history_archive.session(partition)
+            try:
+                transactions += TransactionService._history_page(
+                    source_db, user_id, token_type, limit - len(transactions), last_id
+                )
+            finally:
+                if partition is not None:
+                    source_db.close()
+            last_id = None
+        
+        return transactions
+
+    @staticmethod
+    def _history_page(
+        db: Session,
+        user_id: int,
+        token_type: Optional[TokenType],
+        limit: int,
+        last_id: Optional[int]
     ) -> list[TransactionHistory]:
-        """Get transaction history for a user"""
         query = db.query(TransactionHistory).filter(TransactionHistory.user_id == user_id)
         
         if token_type:
             query = query.filter(TransactionHistory.token_type == token_type)
+
+        if last_id is not None:
+            query = TransactionService._seek_past(query, last_id)
         
-        transactions = query.order_by(TransactionHistory.created_at.desc()).limit(limit).all()
-        
-        return transactions
+        return query.order_by(
+            TransactionHistory.created_at.desc(),
+            TransactionHistory.id.desc()
+        ).limit(limit).all()
+
+    @staticmethod
+    def _seek_past(query, last_id: int, descending: bool = True):
+        """Keep only rows after last_id in (created_at, id) order"""
+        # Compare against the stored created_at of the last row rather than a
+        # re-bound datetime, whose text form can differ from the stored one
+        last_created_at = select(TransactionHistory.created_at).where(
+            TransactionHistory.id == last_id
+        ).scalar_subquery()
+        position = tuple_(TransactionHistory.created_at, TransactionHistory.id)
+        last = tuple_(last_created_at, last_id)
+        return query.filter(position < last if descending else position > last)
+
+    @staticmethod
+    def iter_user_transaction_batches(
+        user_id: int,
+        token_type: Optional[TokenType] = None,
+        batch_size: int = 1000
+    ) -> Iterator[list]:
+        """Yield a user's complete transaction history, oldest first, in batches of rows.
+
+        Rows are plain column tuples (no ORM objects) and each batch is its own
+        short index seek, so memory stays constant and no read is held open
+        while the caller streams a batch to a slow client. Archived partitions
+        come first, oldest to newest, followed by the hot table.
+        """
+        columns = (
+            TransactionHistory.id,
+            TransactionHistory.created_at,
+            TransactionHistory.token_type,
+            TransactionHistory.transaction_type,
+            TransactionHistory.amount,
+            TransactionHistory.balance_before,
+            TransactionHistory.balance_after,
+            TransactionHistory.related_trade_id,
+            TransactionHistory.description
+        )
+        query = select(*columns).where(TransactionHistory.user_id == user_id)
+        if token_type:
+            query = query.where(TransactionHistory.token_type == token_type)
+        query = query.order_by(TransactionHistory.created_at, TransactionHistory.id).limit(batch_size)
+
+        for partition in history_archive.partitions():
+            yield from TransactionService._iter_batches(history_archive.session(partition), query, batch_size)
+        yield from TransactionService._iter_batches(SessionLocal(), query, batch_size)
+
+    @staticmethod
+    def _iter_batches(db: Session, query, batch_size: int) -> Iterator[list]:
+        try:
+            last_id = None
+            while True:
+                page = query if last_id is None else TransactionService._seek_past(query, last_id, descending=False)
+                rows = db.execute(page).all()
+                db.rollback()
+                if not rows:
+                    return
+                yield rows
+                if len(rows) < batch_size:
+                    return
+                last_id = rows[-1].id
+        finally:
+            db.close()
+
+    @staticmethod
+    def encode_cursor(transaction: TransactionHistory) -> str:
+        """Opaque cursor pointing just past a transaction history row"""
+        return base64.urlsafe_b64encode(f"th:{transaction.id}".encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> int:
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            prefix, last_id = base64.urlsafe_b64decode(padded).decode().split(":")
+            if prefix != "th":
+                raise ValueError(prefix)
+            return int(last_id)
+        except ValueError:
+            raise ValueError("Invalid pagination cursor")
     
     @staticmethod
     def get_user_balance_history(
         user_id: int,
         db: Session,
         token_type: Optional[TokenType] = None,
-        days: int = 30
-    ) -> list[BalanceSnapshot]:
-        """Get balance history for a user"""
-        query = db.query(BalanceSnapshot).filter(BalanceSnapshot.user_id == user_id)
-        
+        days: int = 30,
+        resolution: BalanceResolution = BalanceResolution.DAY
+    ) -> list:
+        """Get balance history for a user over the last `days` days, newest first.
+
+        DAY returns the raw snapshots; WEEK and MONTH return the rollups of the
+        periods overlapping the range.
+        """
+        since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+
+        if resolution == BalanceResolution.DAY:
+            query = db.query(BalanceSnapshot).filter(
+                BalanceSnapshot.user_id == user_id,
+                BalanceSnapshot.snapshot_date >= since
+            )
+            if token_type:
+                query = query.filter(BalanceSnapshot.token_type == token_type)
+            return query.order_by(BalanceSnapshot.snapshot_date.desc()).all()
+
+        if resolution == BalanceResolution.WEEK:
+            since -= timedelta(days=since.weekday())
+        else:
+            since = since.replace(day=1)
+
+        query = db.query(BalanceRollup).filter(
+            BalanceRollup.user_id == user_id,
+            BalanceRollup.resolution == resolution,
+            BalanceRollup.period_start >= since
+        )
         if token_type:
-            query = query.filter(BalanceSnapshot.token_type == token_type)
-        
-        snapshots = query.order_by(BalanceSnapshot.snapshot_date.desc()).limit(days).all()
-        
-        return snapshots
+            query = query.filter(BalanceRollup.token_type == token_type)
+        return query.order_by(BalanceRollup.period_start.desc()).all()